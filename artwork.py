@@ -0,0 +1,205 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import Any, Callable, Dict, Optional
+from telegram.error import BadRequest
+from singleflight import SingleFlight
+from bot import is_invalid_file_id
+
+ARTWORK_CACHE_PATH = os.environ.get("ARTWORK_CACHE_PATH", "./artwork_cache")
+ARTWORK_CACHE_MAX_BYTES = int(os.environ.get("ARTWORK_CACHE_MAX_BYTES", 50 * 1024 * 1024))  # Tamaño máximo en disco
+ARTWORK_PHOTO_IDS_MAX = 5000  # Imágenes cuyo file_id de Telegram se recuerda
+PHOTO_IDS_FILE = "photo_ids.json"
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        data = f.read()
+    # Actualizar la fecha de acceso para conservar el orden LRU entre reinicios
+    os.utime(path)
+    return data
+
+def _write_file_atomic(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+class ArtworkCache:
+    """
+    Caché de carátulas y fotos de artistas.
+    
+    Guarda en disco los bytes de cada imagen (por URL de Deezer) con un límite
+    de tamaño y desalojo LRU, y recuerda el file_id de Telegram de las fotos ya
+    enviadas para reenviarlas sin volver a subirlas. Las miniaturas de audio no
+    admiten file_id, así que para ellas sólo se reutilizan los bytes.
+    """
+    
+    def __init__(self, http_client, path: str = ARTWORK_CACHE_PATH, max_bytes: int = ARTWORK_CACHE_MAX_BYTES):
+        self._http = http_client
+        self.path = path
+        self.max_bytes = max_bytes
+        self._inflight = SingleFlight("artwork")
+        self._files: "OrderedDict[str, int]" = OrderedDict()
+        self._size = 0
+        self._photo_ids: "OrderedDict[str, str]" = OrderedDict()
+        # Las escrituras del índice de fotos van en hilos: sólo se guarda la copia más reciente
+        self._photo_ids_lock = threading.Lock()
+        self._photo_ids_version = 0
+        self._photo_ids_saved = 0
+        self.hits = 0
+        self.misses = 0
+        self.photo_hits = 0
+        self._load()
+    
+    def _load(self) -> None:
+        """Indexa las imágenes ya guardadas (por antigüedad de acceso) y los file_id conocidos."""
+        os.makedirs(self.path, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(".img"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self._size += size
+        
+        try:
+            with open(os.path.join(self.path, PHOTO_IDS_FILE), "r", encoding="utf-8") as f:
+                self._photo_ids.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"No se pudo leer el índice de fotos de la caché de carátulas: {str(e)}")
+        self._evict()
+    
+    def _file_name(self, url: str) -> str:
+        return hashlib.sha1(url.encode("utf-8")).hexdigest() + ".img"
+    
+    async def get_bytes(self, url: str) -> Optional[bytes]:
+        """
+        Devuelve los bytes de una imagen, descargándola sólo si no está en disco.
+        
+        Args:
+            url: URL de la imagen en Deezer
+        
+        Returns:
+            El contenido de la imagen, o None si no se pudo descargar
+        """
+        name = self._file_name(url)
+        if name in self._files:
+            try:
+                data = await asyncio.to_thread(_read_file, os.path.join(self.path, name))
+                self._files.move_to_end(name)
+                self.hits += 1
+                return data
+            except OSError:
+                # Borrada desde fuera: olvidarla y descargarla de nuevo
+                self._size -= self._files.pop(name, 0)
+        
+        return await self._inflight.do(name, lambda: self._fetch(url, name))
+    
+    async def _fetch(self, url: str, name: str) -> Optional[bytes]:
+        self.misses += 1
+        data = await self._http.get_bytes(url)
+        if data is None:
+            return None
+        try:
+            await asyncio.to_thread(_write_file_atomic, os.path.join(self.path, name), data)
+        except OSError as e:
+            logging.warning(f"No se pudo guardar la imagen en la caché: {str(e)}")
+            return data
+        self._size += len(data) - self._files.pop(name, 0)
+        self._files[name] = len(data)
+        self._evict()
+        return data
+    
+    def _evict(self) -> None:
+        """Borra las imágenes usadas hace más tiempo hasta respetar el tamaño máximo."""
+        while self._size > self.max_bytes and len(self._files) > 1:
+            name, size = self._files.popitem(last=False)
+            self._size -= size
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+    
+    def _save_photo_ids(self, photo_ids: Dict[str, str], version: int) -> None:
+        try:
+            with self._photo_ids_lock:
+                if version < self._photo_ids_saved:
+                    return
+                _write_file_atomic(
+                    os.path.join(self.path, PHOTO_IDS_FILE),
+                    json.dumps(photo_ids, ensure_ascii=False).encode("utf-8")
+                )
+                self._photo_ids_saved = version
+        except OSError as e:
+            logging.warning(f"No se pudo guardar el índice de fotos de la caché de carátulas: {str(e)}")
+    
+    async def _remember_photo(self, url: str, file_id: str) -> None:
+        self._photo_ids[url] = file_id
+        self._photo_ids.move_to_end(url)
+        while len(self._photo_ids) > ARTWORK_PHOTO_IDS_MAX:
+            self._photo_ids.popitem(last=False)
+        # Se copia en el bucle de eventos, que es el único que modifica el índice
+        self._photo_ids_version += 1
+        await asyncio.to_thread(self._save_photo_ids, dict(self._photo_ids), self._photo_ids_version)
+    
+    async def send_photo(self, send: Callable, url: str, filename: str, **kwargs) -> Optional[Any]:
+        """
+        Envía una imagen como foto reutilizando su file_id si ya se subió antes.
+        
+        Args:
+            send: Función de envío (context.bot.send_photo o message.reply_photo)
+            url: URL de la imagen en Deezer
+            filename: Nombre del archivo si hay que subirla
+            **kwargs: Resto de argumentos para send (chat_id, caption, reply_markup...)
+        
+        Returns:
+            El mensaje enviado, o None si no se pudo obtener la imagen
+        """
+        file_id = self._photo_ids.get(url)
+        if file_id:
+            try:
+                message = await send(photo=file_id, **kwargs)
+                self._photo_ids.move_to_end(url)
+                self.photo_hits += 1
+                return message
+            except BadRequest as e:
+                # Otros errores (p.ej. un caption mal formado) no dependen del file_id
+                if not is_invalid_file_id(e):
+                    raise
+                # file_id no válido (p.ej. otro bot): volver a subir la imagen
+                logging.warning(f"No se pudo reutilizar la foto en caché, subiéndola de nuevo: {str(e)}")
+                del self._photo_ids[url]
+        
+        data = await self.get_bytes(url)
+        if data is None:
+            return None
+        photo = BytesIO(data)
+        photo.name = filename
+        message = await send(photo=photo, **kwargs)
+        if message and message.photo:
+            await self._remember_photo(url, message.photo[-1].file_id)
+        return message
+    
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve el estado de la caché."""
+        return {
+            "files": len(self._files),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "photo_ids": len(self._photo_ids),
+            "photo_hits": self.photo_hits,
+        }
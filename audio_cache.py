@@ -0,0 +1,131 @@
+import os
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from downloader import DOWNLOAD_PATH
+
+AUDIO_CACHE_PATH = os.path.join(DOWNLOAD_PATH, "cache")
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get("AUDIO_CACHE_MAX_BYTES", 0))  # Tamaño máximo (0 = desactivada)
+AUDIO_CACHE_LOW_WATERMARK = float(os.environ.get("AUDIO_CACHE_LOW_WATERMARK", 0.8))  # Fracción a la que se reduce al desalojar
+
+class AudioCache:
+    """
+    Caché en disco de los audios ya descargados, por clave "{track_id}_{bitrate}".
+    
+    Evita repetir la descarga con deemix si hay que volver a subir una pista.
+    Cuando el tamaño supera max_bytes (marca alta) se borran los audios usados
+    hace más tiempo hasta bajar a low_watermark * max_bytes (marca baja). Con
+    max_bytes = 0 está desactivada y los audios se borran tras subirlos.
+    """
+    
+    def __init__(self, path: str = AUDIO_CACHE_PATH, max_bytes: int = AUDIO_CACHE_MAX_BYTES,
+                 low_watermark: float = AUDIO_CACHE_LOW_WATERMARK):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.low_watermark = low_watermark
+        self._entries: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        if self.enabled:
+            self._load()
+    
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+    
+    def _load(self) -> None:
+        """Indexa los audios ya guardados, del usado hace más tiempo al más reciente."""
+        os.makedirs(self.path, exist_ok=True)
+        entries = []
+        for key_dir in os.scandir(self.path):
+            if not key_dir.is_dir():
+                continue
+            for entry in os.scandir(key_dir.path):
+                if entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, key_dir.name, entry.path, stat.st_size))
+        for _, key, path, size in sorted(entries):
+            self._entries[key] = (path, size)
+            self._size += size
+        self._evict()
+    
+    def get(self, key: str) -> Optional[str]:
+        """Devuelve la ruta del audio guardado para la clave, si existe."""
+        entry = self._entries.get(key)
+        if entry and os.path.exists(entry[0]):
+            self._entries.move_to_end(key)
+            os.utime(entry[0])
+            self.hits += 1
+            return entry[0]
+        if entry:
+            self._remove(key)
+        self.misses += 1
+        return None
+    
+    def put(self, key: str, file_path: str) -> Optional[str]:
+        """
+        Guarda un audio descargado en la caché (o lo borra si está desactivada).
+        
+        Args:
+            key: Clave de la pista en el vault
+            file_path: Ruta del audio descargado; el archivo se mueve a la caché
+        
+        Returns:
+            La ruta del audio dentro de la caché, o None si no se guardó
+        """
+        if not os.path.exists(file_path):
+            return None
+        if not self.enabled:
+            os.remove(file_path)
+            return None
+        
+        # Un directorio por clave para conservar el nombre original del archivo
+        target = os.path.join(self.path, key, os.path.basename(file_path))
+        if os.path.abspath(file_path) != os.path.abspath(target):
+            try:
+                if key in self._entries:
+                    self._remove(key)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(file_path, target)
+            except OSError as e:
+                logging.warning(f"No se pudo guardar {key} en la caché de audio: {str(e)}")
+                os.remove(file_path)
+                return None
+        if key in self._entries:
+            self._remove(key, delete=False)
+        size = os.path.getsize(target)
+        self._entries[key] = (target, size)
+        self._size += size
+        if self._size > self.max_bytes:
+            self._evict()
+        return target if key in self._entries else None
+    
+    def _remove(self, key: str, delete: bool = True) -> None:
+        path, size = self._entries.pop(key)
+        self._size -= size
+        if delete:
+            try:
+                os.remove(path)
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+    
+    def _evict(self) -> None:
+        """Desaloja los audios usados hace más tiempo hasta la marca baja."""
+        if self._size <= self.max_bytes:
+            return
+        target = self.max_bytes * self.low_watermark
+        while self._entries and self._size > target:
+            self._remove(next(iter(self._entries)))
+    
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve el estado de la caché."""
+        return {
+            "enabled": self.enabled,
+            "files": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
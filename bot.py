@@ -4,12 +4,15 @@ import os
 import shutil
 import asyncio
 from typing import List, Union
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaAudio
 from telegram.ext import ContextTypes, CallbackContext
-from vault import load_vault, save_vault, add_to_vault, get_from_vault
-from downloader import download_track
+from telegram.error import BadRequest
+from vault import (load_vault, save_vault, add_to_vault, get_from_vault, find_track_in_vault, resolve_collection,
+                   isrc_key, remove_file_id_from_vault)
+from downloader import download_track, DownloadQueueFull
+from progress import ProgressReporter
+from metadata import TrackMetadata
 from deemix.settings import load, save
-import requests
 from io import BytesIO
 
 # Definir formatos de audio
@@ -51,108 +54,218 @@ def extract_id_from_url(url: str) -> str:
             return match.group(3)
     return ""
 
-# Añadir al inicio del archivo, después de las importaciones
-BATCH_SIZE = 5  # Número de pistas por lote
+async def find_by_isrc(deezer, track_id, bitrate, metadata=None):
+    """
+    Busca en el vault la misma grabación guardada bajo otro track_id.
+    
+    Args:
+        deezer: Fachada asíncrona DeezerAPI
+        track_id: ID de la pista de Deezer
+        bitrate: Bitrate pedido
+        metadata: TrackMetadata ya conocido de la pista (opcional); si trae
+            el ISRC no se consulta la API
+        
+    Returns:
+        Tupla (file_id o None, bitrate con el que está guardado o None,
+        TrackMetadata o None). El bitrate puede ser otra calidad según
+        VAULT_QUALITY_FALLBACK; los metadatos se devuelven para reutilizarlos
+        al subir la pista si hay que descargarla.
+    """
+    if not metadata or not metadata.isrc:
+        try:
+            track_info = await deezer.get_track(track_id)
+        except Exception as e:
+            logging.warning(f"No se pudo obtener el ISRC de la pista {track_id}: {str(e)}")
+            return None, None, metadata
+        if track_info:
+            metadata = TrackMetadata.from_deezer(track_info).merge(metadata)
+    
+    isrc = metadata.isrc if metadata else None
+    if not isrc:
+        return None, None, metadata
+    
+    file_id, matched_bitrate = find_track_in_vault(isrc_key(isrc, bitrate))
+    if file_id:
+        logging.info(f"Pista {track_id} encontrada en caché por ISRC {isrc}")
+    return file_id, matched_bitrate, metadata
+
+# Pistas de una colección que se descargan/suben a la vez
+COLLECTION_CONCURRENCY = int(os.environ.get("COLLECTION_CONCURRENCY", 3))
+# Máximo de audios por álbum de Telegram (send_media_group)
+MEDIA_GROUP_SIZE = 10
 
-# Añadir esta nueva función para procesar playlists grandes por lotes
-async def process_playlist_in_batches(update, context, track_urls, track_ids, track_titles, 
-                                     dz, settings, listener, vault_chat_id, 
-                                     status_message, cache_key, content_type):
+def is_invalid_file_id(error: Exception) -> bool:
+    """Indica si Telegram rechazó un file_id guardado (caducado, de otro bot...)."""
+    return isinstance(error, BadRequest) and "file" in str(error).lower()
+
+def forget_file_id(file_id, error):
+    """Elimina del vault un file_id que Telegram ya no acepta."""
+    keys = remove_file_id_from_vault(file_id)
+    logging.warning(f"Telegram ya no acepta el file_id de {', '.join(keys) or 'una pista'}, se vuelve a subir: {str(error)}")
+
+async def reply_track(update, file_id, refetch):
     """
-    Procesa una playlist grande en lotes.
+    Envía al usuario una pista del vault.
+    
+    Si Telegram ya no acepta el file_id guardado, se elimina del vault y se
+    vuelve a obtener la pista con refetch (obtain_track, que la sube desde la
+    caché local de audio si sigue ahí) antes de enviarla.
+    
+    Args:
+        update: Update del mensaje al que responder
+        file_id: File ID guardado en el vault
+        refetch: Función sin argumentos que devuelve la corrutina que obtiene un file_id nuevo
+    
+    Returns:
+        El file_id enviado
     """
-    total_tracks = len(track_urls)
-    total_batches = (total_tracks + BATCH_SIZE - 1) // BATCH_SIZE  # Redondeo hacia arriba
+    try:
+        await update.message.reply_audio(audio=file_id)
+        return file_id
+    except BadRequest as e:
+        if not is_invalid_file_id(e):
+            raise
+        forget_file_id(file_id, e)
+    file_id = await refetch()
+    await update.message.reply_audio(audio=file_id)
+    return file_id
+
+async def send_cached_audios(context, chat_id, file_ids, refetch=None):
+    """
+    Envía audios ya guardados en el vault agrupados en álbumes de Telegram.
     
-    file_ids_all = []
-    successful_tracks = 0
+    Se mandan en orden, en grupos de hasta MEDIA_GROUP_SIZE por petición. Si
+    un grupo falla, sus pistas se envían una a una; un file_id que Telegram
+    ya no acepta se elimina del vault y, si se indica refetch, se vuelve a
+    obtener la pista.
     
-    for batch_num in range(total_batches):
-        start_idx = batch_num * BATCH_SIZE
-        end_idx = min(start_idx + BATCH_SIZE, total_tracks)
-        
-        # Obtener listas para este lote
-        batch_urls = track_urls[start_idx:end_idx]
-        batch_ids = track_ids[start_idx:end_idx]
-        batch_titles = track_titles[start_idx:end_idx]
-        
-        # Actualizar mensaje de estado
-        await status_message.edit_text(
-            f"⏳ Lote {batch_num+1}/{total_batches}: Descargando pistas {start_idx+1}-{end_idx} de {total_tracks}..."
-        )
-        
-        # Descargar y enviar pistas de este lote
-        file_ids_batch = []
-        for i, (track_url, track_id, track_title) in enumerate(zip(batch_urls, batch_ids, batch_titles)):
+    Args:
+        context: Contexto del bot
+        chat_id: ID del chat destino
+        file_ids: Lista ordenada de file_id de audio
+        refetch: Función que recibe la posición en file_ids y devuelve la
+            corrutina que obtiene un file_id nuevo (opcional)
+    """
+    for start in range(0, len(file_ids), MEDIA_GROUP_SIZE):
+        chunk = file_ids[start:start + MEDIA_GROUP_SIZE]
+        # Un álbum necesita al menos dos elementos
+        if len(chunk) > 1:
             try:
-                # Índice global para mensajes
-                global_idx = start_idx + i
-                
-                # Definir clave de caché para esta pista
-                bitrate = settings.get("maxBitrate", 3)
-                individual_cache_key = f"{track_id}_{bitrate}"
-                
-                # Verificar si esta pista específica está en caché
-                cached_track = get_from_vault(individual_cache_key)
-                if cached_track:
-                    file_ids_batch.append(cached_track)
-                    file_ids_all.append(cached_track)
-                    await update.message.reply_audio(audio=cached_track)
-                    successful_tracks += 1
-                    continue
-                
-                # Actualizar mensaje para esta pista
-                await status_message.edit_text(
-                    f"⏳ Lote {batch_num+1}/{total_batches}: Descargando pista {global_idx+1}/{total_tracks}: {track_title}"
+                await context.bot.send_media_group(
+                    chat_id=chat_id,
+                    media=[InputMediaAudio(media=file_id) for file_id in chunk]
                 )
-                
-                # Descargar pista individual
-                file_path = await download_track(track_url, dz, settings, listener)
-                
-                # Enviar y guardar en vault
-                file_id = await send_and_save_audio(
-                    context, 
-                    update.message.chat_id, 
-                    file_path, 
-                    f"{content_type.title()} pista {global_idx+1}/{total_tracks}: {track_title}", 
-                    vault_chat_id, 
-                    individual_cache_key,
-                    dz=dz,
-                    track_id=track_id
-                )
-                
-                # Guardar ID en las listas y en vault individual
-                file_ids_batch.append(file_id)
-                file_ids_all.append(file_id)
-                add_to_vault(individual_cache_key, file_id)
-                successful_tracks += 1
-                
-                # Eliminar archivo temporal
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                
-                # Pequeña pausa entre descargas (solo dentro del lote)
-                if i < len(batch_urls) - 1:
-                    await asyncio.sleep(1)
-                    
+                continue
             except Exception as e:
-                logging.error(f"Error descargando pista {start_idx+i+1}: {str(e)}", exc_info=True)
-                await update.message.reply_text(f"⚠️ Error con pista {start_idx+i+1}: {track_title}")
-        
-        # Pequeña pausa entre lotes
-        if batch_num < total_batches - 1:
-            await asyncio.sleep(3)  # Pausa más larga entre lotes
-        
-    # Guardar todos los IDs en el vault como playlist/album completo
-    if file_ids_all:
-        add_to_vault(cache_key, file_ids_all)
-        await status_message.edit_text(
-            f"✅ {content_type.title()} enviado completamente ({successful_tracks}/{total_tracks} pistas)"
+                logging.warning(f"No se pudo enviar el grupo de audios, enviando uno a uno: {str(e)}")
+        for position, file_id in enumerate(chunk, start):
+            try:
+                await context.bot.send_audio(chat_id=chat_id, audio=file_id)
+            except BadRequest as e:
+                if not is_invalid_file_id(e):
+                    raise
+                forget_file_id(file_id, e)
+                if refetch is None:
+                    raise
+                await context.bot.send_audio(chat_id=chat_id, audio=await refetch(position))
+
+async def process_collection_tracks(update, context, track_urls, track_ids, track_titles,
+                                    dz, settings, listener, vault_chat_id,
+                                    progress, content_type, positions=None, total_tracks=None,
+                                    track_metadata=None):
+    """
+    Procesa las pistas de una playlist o álbum en paralelo.
+    
+    Hasta COLLECTION_CONCURRENCY pistas se descargan y suben al vault a la
+    vez; cada pista se entrega al usuario en cuanto están listas ella y todas
+    las anteriores, de modo que se conserva el orden de la colección.
+    
+    Args:
+        progress: ProgressReporter del mensaje de estado
+        positions: Posición (base 0) de cada pista dentro de la colección completa,
+            para numerar correctamente cuando sólo se procesan las pistas que faltan
+        total_tracks: Número de pistas de la colección completa
+        track_metadata: TrackMetadata de cada pista sacado de la lista de la colección
+    
+    Returns:
+        Lista de claves de pista ("{track_id}_{bitrate}") obtenidas correctamente
+    """
+    pending_tracks = len(track_urls)
+    if positions is None:
+        positions = list(range(pending_tracks))
+    if total_tracks is None:
+        total_tracks = pending_tracks
+    if track_metadata is None:
+        track_metadata = [None] * pending_tracks
+    bitrate = settings.get("maxBitrate", 3)
+    semaphore = asyncio.Semaphore(COLLECTION_CONCURRENCY)
+    
+    def download(track_url, track_id, track_title, position, metadata):
+        """Descarga la pista (o la sube desde la caché local de audio) y la guarda en el vault."""
+        return obtain_track(
+            context,
+            f"{track_id}_{bitrate}",
+            track_url,
+            dz, settings, listener, vault_chat_id,
+            f"{content_type.title()} pista {position+1}/{total_tracks}: {track_title}\nTrack: {track_id}",
+            track_id=track_id,
+            metadata=metadata
         )
-    else:
-        await status_message.edit_text(f"❌ No se pudo descargar ninguna pista del {content_type}.")
     
-    return file_ids_all
+    async def fetch(track_url, track_id, track_title, position, metadata):
+        """Devuelve el file_id de una pista, descargándola si no está en el vault."""
+        async with semaphore:
+            individual_cache_key = f"{track_id}_{bitrate}"
+            
+            # Verificar si esta pista específica está en caché
+            cached_track = get_from_vault(individual_cache_key)
+            if cached_track:
+                return cached_track
+            
+            # Misma grabación guardada con otro track_id (recopilatorios, reediciones)
+            cached_track, matched_bitrate, metadata = await find_by_isrc(
+                context.bot_data['deezer'], track_id, bitrate, metadata
+            )
+            if cached_track:
+                # Guardar el alias con la calidad real del archivo, no con la pedida
+                add_to_vault(f"{track_id}_{matched_bitrate}", cached_track)
+                return cached_track
+            
+            # Descargar pista individual y guardarla en el vault
+            return await download(track_url, track_id, track_title, position, metadata)
+    
+    tracks = list(zip(track_urls, track_ids, track_titles, positions, track_metadata))
+    tasks = [asyncio.create_task(fetch(*track)) for track in tracks]
+    track_keys_obtained = []
+    
+    try:
+        # Entregar en el orden de la colección mientras el resto sigue descargándose
+        for i, (task, track) in enumerate(zip(tasks, tracks)):
+            _, track_id, track_title, position, _ = track
+            try:
+                file_id = await task
+                await reply_track(update, file_id, lambda: download(*track))
+                track_keys_obtained.append(f"{track_id}_{bitrate}")
+            except DownloadQueueFull as e:
+                # Pool saturado: no tiene sentido intentar el resto de pistas ahora
+                logging.warning(f"Pool de descargas lleno en pista {position+1}: {str(e)}")
+                await update.message.reply_text(f"⏳ {str(e)}")
+                break
+            except Exception as e:
+                logging.error(f"Error descargando pista {position+1}: {str(e)}", exc_info=True)
+                await update.message.reply_text(f"⚠️ Error con pista {position+1}: {track_title}")
+            
+            if i < pending_tracks - 1:
+                await progress.update(
+                    f"⏳ {i+1}/{pending_tracks} pistas de {content_type} enviadas..."
+                )
+    finally:
+        # Cancelar lo que quede pendiente (error o cancelación) y recoger sus excepciones
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    return track_keys_obtained
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja el comando /start."""
@@ -206,7 +319,8 @@ async def config_callback(update: Update, context: CallbackContext):
     
     await query.edit_message_text(f"✅ Calidad actualizada a: {format_name}")
 
-async def send_and_save_audio(context, chat_id, file_path, caption, vault_chat_id, key, dz=None, track_id=None):
+async def send_and_save_audio(context, chat_id, file_path, caption, vault_chat_id, key, track_id=None,
+                              metadata=None):
     """
     Envía un archivo de audio y lo guarda en el vault.
     
@@ -217,8 +331,40 @@ async def send_and_save_audio(context, chat_id, file_path, caption, vault_chat_i
         caption: Descripción
         vault_chat_id: ID del chat para almacenar el audio
         key: Clave para el vault
-        dz: Objeto Deezer (opcional)
         track_id: ID de la pista de Deezer (opcional)
+        metadata: TrackMetadata ya conocido de la pista (opcional)
+    
+    Returns:
+        El file_id del audio enviado
+    """
+    file_id = await upload_to_vault(context, file_path, caption, vault_chat_id, key, track_id=track_id,
+                                    metadata=metadata)
+    
+    # Enviar al usuario con el mismo file_id para mantener los metadatos
+    await context.bot.send_audio(
+        chat_id=chat_id,
+        audio=file_id
+    )
+    
+    return file_id
+
+async def upload_to_vault(context, file_path, caption, vault_chat_id, key, track_id=None, metadata=None):
+    """
+    Sube un archivo de audio al canal del vault con sus metadatos.
+    
+    Los metadatos que ya se conocen (p.ej. de la lista de pistas de un álbum)
+    no se vuelven a pedir; sólo se consulta la API de Deezer si falta alguno.
+    Si la pista tiene ISRC, el file_id se registra también en el índice por
+    ISRC para reutilizarlo con otros track_id de la misma grabación.
+    
+    Args:
+        context: Contexto del bot
+        file_path: Ruta al archivo local
+        caption: Descripción
+        vault_chat_id: ID del chat para almacenar el audio
+        key: Clave para el vault
+        track_id: ID de la pista de Deezer (opcional)
+        metadata: TrackMetadata ya conocido de la pista (opcional)
     
     Returns:
         El file_id del audio enviado
@@ -229,29 +375,29 @@ async def send_and_save_audio(context, chat_id, file_path, caption, vault_chat_i
         performer = None
         duration = None
         thumbnail = None  # Cambiado de thumb a thumbnail (nombre correcto)
+        isrc = None
         
-        # Intentar obtener metadatos de Deezer si se proporcionan dz y track_id
-        if dz and track_id and str(track_id).isdigit():
+        # Completar con la API de Deezer sólo los metadatos que falten
+        if (not metadata or not metadata.complete) and track_id and str(track_id).isdigit():
             try:
-                track_info = dz.api.get_track(track_id)
+                track_info = await context.bot_data['deezer'].get_track(track_id)
                 if track_info:
-                    title = track_info.get('title')
-                    performer = track_info.get('artist', {}).get('name')
-                    duration = track_info.get('duration')
-                    
-                    # Obtener URL de la miniatura
-                    album_info = track_info.get('album', {})
-                    cover_url = album_info.get('cover_medium') or album_info.get('cover_small')
-                    
-                    if cover_url:
-                        # Descargar imagen de carátula
-                        response = requests.get(cover_url)
-                        if response.status_code == 200:
-                            thumbnail = BytesIO(response.content)
-                            thumbnail.name = "cover.jpg"
+                    metadata = TrackMetadata.from_deezer(track_info).merge(metadata)
             except Exception as e:
                 logging.warning(f"No se pudieron obtener metadatos de Deezer: {str(e)}")
         
+        if metadata:
+            isrc = metadata.isrc
+            title = metadata.title
+            performer = metadata.performer
+            duration = metadata.duration
+            
+            # Carátula (compartida entre las pistas de un mismo álbum)
+            cover = await metadata.load_cover(context.bot_data['artwork'])
+            if cover:
+                thumbnail = BytesIO(cover)
+                thumbnail.name = "cover.jpg"
+        
         # Si no se pudieron obtener metadatos, extraer del nombre del archivo
         if not title or not performer:
             # Extraer información del nombre del archivo
@@ -294,17 +440,66 @@ async def send_and_save_audio(context, chat_id, file_path, caption, vault_chat_i
             
         file_id = sent_message.audio.file_id
         
-        # Enviar al usuario con el mismo file_id para mantener los metadatos
-        await context.bot.send_audio(
-            chat_id=chat_id,
-            audio=file_id
-        )
+        # Registrar en el índice secundario por ISRC
+        bitrate = key.rsplit("_", 1)[-1] if key else None
+        if isrc and bitrate and bitrate.isdigit():
+            add_to_vault(isrc_key(isrc, bitrate), file_id)
         
         return file_id
     except Exception as e:
-        logging.error(f"Error al enviar audio: {str(e)}", exc_info=True)
+        logging.error(f"Error al subir audio al vault: {str(e)}", exc_info=True)
         raise
 
+async def obtain_track(context, key, track_url, dz, settings, listener, vault_chat_id, caption, track_id=None,
+                       metadata=None):
+    """
+    Descarga una pista, la sube al vault y devuelve su file_id.
+    
+    Las peticiones simultáneas de la misma clave comparten una única descarga
+    y subida a través del registro de trabajos en curso de la aplicación.
+    
+    Args:
+        context: Contexto del bot
+        key: Clave de la pista en el vault ("{track_id}_{bitrate}")
+        track_url: URL de Deezer de la pista
+        caption: Descripción del mensaje en el canal del vault
+        track_id: ID de la pista de Deezer (opcional)
+        metadata: TrackMetadata ya conocido de la pista (opcional)
+    
+    Returns:
+        El file_id de la pista en el vault
+    """
+    async def job():
+        # Otra petición pudo terminar justo antes de registrar esta
+        file_id = get_from_vault(key, quality_fallback=False)
+        if file_id:
+            return file_id
+        
+        # Si el audio sigue en la caché local no hace falta volver a descargarlo
+        audio_cache = context.bot_data.get('audio_cache')
+        file_path = audio_cache.get(key) if audio_cache else None
+        if file_path:
+            logging.info(f"Pista {key} encontrada en la caché local de audio")
+        else:
+            file_path = await download_track(track_url, dz, settings, listener, pool=context.bot_data.get("download_pool"))
+        try:
+            file_id = await upload_to_vault(context, file_path, caption, vault_chat_id, key,
+                                            track_id=track_id, metadata=metadata)
+            add_to_vault(key, file_id)
+        finally:
+            if audio_cache:
+                # Guardar el audio en la caché (o borrarlo si está desactivada)
+                audio_cache.put(key, file_path)
+            elif os.path.exists(file_path):
+                # Eliminar archivo temporal
+                os.remove(file_path)
+        return file_id
+    
+    inflight = context.bot_data.get('inflight')
+    if inflight is None:
+        return await job()
+    return await inflight.do(key, job)
+
 async def handle_message(
     update: Update, 
     context: ContextTypes.DEFAULT_TYPE, 
@@ -327,76 +522,87 @@ async def handle_message(
                 bitrate = settings.get("maxBitrate", 3)
                 cache_key = f"{content_id}_{bitrate}"
                 cached_data = get_from_vault(cache_key)
+                metadata = None
+                
+                def refetch():
+                    # El file_id guardado ya no vale: volver a subir la pista
+                    return obtain_track(context, cache_key, url, dz, settings, listener, vault_chat_id,
+                                        f"Track: {content_id}", track_id=content_id, metadata=metadata)
+                
+                if cached_data:
+                    await update.message.reply_text("🎵 Encontrado en caché")
+                    await reply_track(update, cached_data, refetch)
+                    return
                 
+                # Misma grabación guardada con otro track_id (recopilatorios, reediciones)
+                cached_data, matched_bitrate, metadata = await find_by_isrc(context.bot_data['deezer'], content_id, bitrate)
                 if cached_data:
+                    # Guardar el alias con la calidad real del archivo, no con la pedida
+                    add_to_vault(f"{content_id}_{matched_bitrate}", cached_data)
                     await update.message.reply_text("🎵 Encontrado en caché")
-                    await update.message.reply_audio(audio=cached_data)
+                    await reply_track(update, cached_data, refetch)
                     return
                 
                 # Notificar inicio de descarga
-                status_message = await update.message.reply_text("⏳ Descargando pista...")
+                progress = await ProgressReporter.create(update.message, "⏳ Descargando pista...")
                 
                 # Descargar track
                 try:
-                    file_path = await download_track(url, dz, settings, listener)
-                    
-                    # Actualizar estado
-                    await status_message.edit_text("✅ Descarga completada. Enviando...")
-                    
-                    # Enviar y guardar en vault
-                    file_id = await send_and_save_audio(
-                        context, 
-                        update.message.chat_id, 
-                        file_path, 
-                        f"Track: {content_id}", 
-                        vault_chat_id, 
+                    file_id = await obtain_track(
+                        context,
                         cache_key,
-                        dz=dz,
-                        track_id=content_id
+                        url,
+                        dz, settings, listener, vault_chat_id,
+                        f"Track: {content_id}",
+                        track_id=content_id,
+                        metadata=metadata
                     )
                     
-                    # Guardar en vault
-                    add_to_vault(cache_key, file_id)
-                    
-                    # Eliminar archivo temporal
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
+                    # Enviar al usuario
+                    await progress.update("✅ Descarga completada. Enviando...")
+                    await reply_track(update, file_id, refetch)
                     
                     # Actualizar mensaje de estado
-                    await status_message.edit_text("✅ Listo")
+                    await progress.finish("✅ Listo")
                     
                 except Exception as e:
                     logging.error(f"Error al descargar: {str(e)}")
-                    await status_message.edit_text(f"❌ Error: {str(e)}")
+                    await progress.finish(f"❌ Error: {str(e)}")
             
             elif content_type in ["album", "playlist"]:
                 cache_key = f"{content_type}_{content_id}"
-                cached_data = get_from_vault(cache_key)
-                
-                if cached_data and isinstance(cached_data, list):
-                    await update.message.reply_text(f"📂 {content_type.title()} encontrado en caché")
-                    for file_id in cached_data:
-                        await update.message.reply_audio(audio=file_id)
-                    return
                 
                 # Notificar inicio de descarga
-                status_message = await update.message.reply_text(f"⏳ Obteniendo información de {content_type}...")
+                progress = await ProgressReporter.create(update.message, f"⏳ Obteniendo información de {content_type}...")
                 
                 try:
                     # Obtener información del álbum/playlist
                     collection_info = None
-                    if content_type == "album":
-                        collection_info = dz.api.get_album(content_id)
-                    else:  # playlist
-                        collection_info = dz.api.get_playlist(content_id)
+                    try:
+                        if content_type == "album":
+                            collection_info = await context.bot_data['deezer'].get_album(content_id)
+                        else:  # playlist
+                            collection_info = await context.bot_data['deezer'].get_playlist(content_id)
+                    except Exception as e:
+                        # Sin lista de pistas actual, servir la colección guardada si existe
+                        cached_data = resolve_collection(cache_key)
+                        if not cached_data:
+                            raise
+                        logging.warning(f"No se pudo obtener {content_type} de Deezer, usando caché: {str(e)}")
+                        await progress.finish(f"📂 {content_type.title()} encontrado en caché")
+                        await send_cached_audios(context, update.message.chat_id, cached_data)
+                        return
                     
                     # Extraer metadatos y URLs de pistas
                     track_urls = []
                     track_ids = []
                     track_titles = []
+                    track_metadata = []
                     
                     try:
                         tracks = collection_info.get('tracks', {}).get('data', [])
+                        # Las pistas de get_album no incluyen su álbum: la carátula es la del propio álbum
+                        album = collection_info if content_type == "album" else None
                         for track in tracks:
                             track_id = track.get('id')
                             if track_id:
@@ -405,91 +611,100 @@ async def handle_message(
                                 artist_name = track.get('artist', {}).get('name', 'Desconocido')
                                 track_title = track.get('title', 'Sin título')
                                 track_titles.append(f"{artist_name} - {track_title}")
+                                track_metadata.append(TrackMetadata.from_deezer(track, album=album))
                     except Exception as e:
                         logging.warning(f"No se pudo obtener lista de tracks: {str(e)}")
                         # Si falló la obtención de metadatos, intentar descargar la playlist/álbum completo
                         return await download_complete_collection(update, context, url, content_type, content_id, 
-                                                                dz, settings, listener, vault_chat_id, cache_key, status_message)
+                                                                dz, settings, listener, vault_chat_id, cache_key, progress)
                     
                     if not track_urls:
-                        await status_message.edit_text(f"❌ No se encontraron pistas en el {content_type}.")
+                        await progress.finish(f"❌ No se encontraron pistas en el {content_type}.")
                         return
                     
                     total_tracks = len(track_urls)
                     logging.info(f"Pistas encontradas en {content_type}: {total_tracks}")
                     
+                    # Separar las pistas ya guardadas en el vault de las que faltan
+                    bitrate = settings.get("maxBitrate", 3)
+                    track_keys = [f"{track_id}_{bitrate}" for track_id in track_ids]
+                    cached_file_ids = {}
+                    missing = []
+                    for position, key in enumerate(track_keys):
+                        cached_track = get_from_vault(key)
+                        if cached_track:
+                            cached_file_ids[key] = cached_track
+                        else:
+                            missing.append(position)
+                    logging.info(f"{content_type.title()} {content_id}: {len(cached_file_ids)} pistas en caché, {len(missing)} por descargar")
+                    
+                    # /album/{id}/tracks trae el ISRC de todas las pistas: una petición en lugar de una por pista
+                    if content_type == "album" and missing:
+                        try:
+                            album_tracks = (await context.bot_data['deezer'].get_album_tracks(content_id)).get('data', [])
+                            isrcs = {str(track.get('id')): track.get('isrc') for track in album_tracks}
+                            for i in missing:
+                                track_metadata[i].isrc = track_metadata[i].isrc or isrcs.get(track_ids[i])
+                        except Exception as e:
+                            logging.warning(f"No se pudieron obtener los ISRC del álbum {content_id}: {str(e)}")
+                    
+                    def refetch_track(i):
+                        # Pista i de la colección cuyo file_id guardado ya no vale
+                        return obtain_track(
+                            context, track_keys[i], track_urls[i], dz, settings, listener, vault_chat_id,
+                            f"{content_type.title()} pista {i+1}/{total_tracks}: {track_titles[i]}\nTrack: {track_ids[i]}",
+                            track_id=track_ids[i], metadata=track_metadata[i]
+                        )
+                    
+                    if not missing:
+                        await progress.finish(f"📂 {content_type.title()} encontrado en caché")
+                        await send_cached_audios(context, update.message.chat_id,
+                                                 [cached_file_ids[key] for key in track_keys], refetch_track)
+                        add_to_vault(cache_key, track_keys)
+                        return
+                    
                     # Enviar vista previa de la colección
                     await send_collection_preview(update, context, collection_info, content_type, total_tracks)
                     
+                    # Entregar de inmediato las pistas que ya están en caché
+                    if cached_file_ids:
+                        await progress.update(
+                            f"📂 {len(cached_file_ids)}/{total_tracks} pistas en caché. Enviando..."
+                        )
+                        cached_positions = [i for i, key in enumerate(track_keys) if key in cached_file_ids]
+                        await send_cached_audios(context, update.message.chat_id,
+                                                 [cached_file_ids[track_keys[i]] for i in cached_positions],
+                                                 lambda j: refetch_track(cached_positions[j]))
+                    
                     # Actualizar mensaje de estado
-                    await status_message.edit_text(f"⏳ Procesando {total_tracks} pistas de {content_type}...")
+                    await progress.update(f"⏳ Procesando {len(missing)} pistas de {content_type}...")
+                    
+                    # Descargar sólo las pistas que faltan
+                    downloaded_keys = await process_collection_tracks(
+                        update, context,
+                        [track_urls[i] for i in missing],
+                        [track_ids[i] for i in missing],
+                        [track_titles[i] for i in missing],
+                        dz, settings, listener, vault_chat_id,
+                        progress, content_type,
+                        positions=missing, total_tracks=total_tracks,
+                        track_metadata=[track_metadata[i] for i in missing]
+                    )
                     
-                    # Determinar si procesar por lotes o individualmente
-                    if total_tracks > BATCH_SIZE:
-                        # Procesar en lotes para playlists grandes
-                        await process_playlist_in_batches(update, context, track_urls, track_ids, track_titles, 
-                                                         dz, settings, listener, vault_chat_id, 
-                                                         status_message, cache_key, content_type)
+                    # Guardar la playlist/album como referencias ordenadas a las pistas individuales
+                    obtained = set(cached_file_ids) | set(downloaded_keys)
+                    collection_keys = [key for key in track_keys if key in obtained]
+                    if downloaded_keys:
+                        add_to_vault(cache_key, collection_keys)
+                        await progress.finish(
+                            f"✅ {content_type.title()} enviado completamente ({len(collection_keys)}/{total_tracks} pistas)"
+                        )
                     else:
-                        # Para pocas pistas, procesar individualmente
-                        file_ids = []
-                        for i, (track_url, track_id, track_title) in enumerate(zip(track_urls, track_ids, track_titles)):
-                            try:
-                                # Definir clave de caché para esta pista
-                                bitrate = settings.get("maxBitrate", 3)
-                                individual_cache_key = f"{track_id}_{bitrate}"
-                                
-                                # Verificar si esta pista específica está en caché
-                                cached_track = get_from_vault(individual_cache_key)
-                                if cached_track:
-                                    file_ids.append(cached_track)
-                                    await update.message.reply_audio(audio=cached_track)
-                                    continue
-                                
-                                # Actualizar mensaje de estado
-                                await status_message.edit_text(f"⏳ Descargando pista {i+1}/{total_tracks}: {track_title}")
-                                
-                                # Descargar pista individual
-                                file_path = await download_track(track_url, dz, settings, listener)
-                                
-                                # Enviar y guardar en vault
-                                file_id = await send_and_save_audio(
-                                    context, 
-                                    update.message.chat_id, 
-                                    file_path, 
-                                    f"{content_type.title()} pista {i+1}/{total_tracks}: {track_title}", 
-                                    vault_chat_id, 
-                                    individual_cache_key,
-                                    dz=dz,
-                                    track_id=track_id
-                                )
-                                
-                                # Guardar ID en la lista y en vault individual
-                                file_ids.append(file_id)
-                                add_to_vault(individual_cache_key, file_id)
-                                
-                                # Eliminar archivo temporal
-                                if os.path.exists(file_path):
-                                    os.remove(file_path)
-                                
-                                # Pequeña pausa entre descargas
-                                if i < total_tracks - 1:
-                                    await asyncio.sleep(1)
-                                
-                            except Exception as e:
-                                logging.error(f"Error descargando pista {i+1}: {str(e)}", exc_info=True)
-                                await update.message.reply_text(f"⚠️ Error con pista {i+1}: {track_title}")
-                        
-                        # Guardar todos los IDs en el vault como playlist/album
-                        if file_ids:
-                            add_to_vault(cache_key, file_ids)
-                            await status_message.edit_text(f"✅ {content_type.title()} enviado completamente ({len(file_ids)}/{total_tracks} pistas)")
-                        else:
-                            await status_message.edit_text(f"❌ No se pudo descargar ninguna pista del {content_type}.")
+                        await progress.finish(f"❌ No se pudo descargar ninguna pista del {content_type}.")
                 
                 except Exception as e:
                     logging.error(f"Error al procesar {content_type}: {str(e)}", exc_info=True)
-                    await status_message.edit_text(f"❌ Error: {str(e)}")
+                    await progress.finish(f"❌ Error: {str(e)}")
             
             else:
                 await update.message.reply_text("🔗 Tipo de contenido no soportado")
@@ -503,14 +718,14 @@ async def handle_message(
         await update.message.reply_text("⚠️ Error procesando tu solicitud")
 
 async def download_complete_collection(update, context, url, content_type, content_id, 
-                                     dz, settings, listener, vault_chat_id, cache_key, status_message):
+                                     dz, settings, listener, vault_chat_id, cache_key, progress):
     """Función de respaldo para intentar descargar una colección completa de una vez."""
     try:
         # Actualizar mensaje
-        await status_message.edit_text(f"⏳ Descargando {content_type} completo. Esto puede tardar...")
+        await progress.update(f"⏳ Descargando {content_type} completo. Esto puede tardar...")
         
         # Intentar descargar como colección
-        file_paths = await download_track(url, dz, settings, listener)
+        file_paths = await download_track(url, dz, settings, listener, pool=context.bot_data.get("download_pool"))
         
         if not isinstance(file_paths, list):
             file_paths = [file_paths]
@@ -521,11 +736,11 @@ async def download_complete_collection(update, context, url, content_type, conte
             logging.info(f"Archivo: {fp}")
         
         if len(file_paths) == 0:
-            await status_message.edit_text(f"❌ No se pudo descargar el {content_type}.")
+            await progress.finish(f"❌ No se pudo descargar el {content_type}.")
             return
         
         # Actualizar estado
-        await status_message.edit_text(f"✅ Descarga completada. Enviando {len(file_paths)} pistas...")
+        await progress.update(f"✅ Descarga completada. Enviando {len(file_paths)} pistas...")
         
         # Enviar cada pista y guardar IDs
         file_ids = []
@@ -535,10 +750,6 @@ async def download_complete_collection(update, context, url, content_type, conte
                     logging.error(f"Archivo no encontrado: {file_path}")
                     continue
                 
-                # Añadir delay entre envíos
-                if i > 0:
-                    await asyncio.sleep(1)
-                
                 file_id = await send_and_save_audio(
                     context, 
                     update.message.chat_id, 
@@ -546,7 +757,6 @@ async def download_complete_collection(update, context, url, content_type, conte
                     f"{content_type.title()} track {i+1}/{len(file_paths)}", 
                     vault_chat_id, 
                     f"{cache_key}_{i}",
-                    dz=dz,
                     track_id=None  # Aquí no tenemos track_id disponible
                 )
                 file_ids.append(file_id)
@@ -559,16 +769,16 @@ async def download_complete_collection(update, context, url, content_type, conte
                 logging.error(f"Error enviando pista {i+1}: {str(e)}", exc_info=True)
                 await update.message.reply_text(f"⚠️ Error enviando pista {i+1}")
         
-        # Guardar todos los IDs en el vault
+        # Guardar todos los IDs en el vault (sin track_id no hay pistas a las que referenciar)
         if file_ids:
             add_to_vault(cache_key, file_ids)
-            await status_message.edit_text(f"✅ {content_type.title()} enviado completamente")
+            await progress.finish(f"✅ {content_type.title()} enviado completamente")
         else:
-            await status_message.edit_text(f"❌ No se pudo enviar ninguna pista del {content_type}.")
+            await progress.finish(f"❌ No se pudo enviar ninguna pista del {content_type}.")
             
     except Exception as e:
         logging.error(f"Error en download_complete_collection: {str(e)}", exc_info=True)
-        await status_message.edit_text(f"❌ Error: {str(e)}")
+        await progress.finish(f"❌ Error: {str(e)}")
 
 # Función para descargar y enviar la vista previa de playlist/álbum
 async def send_collection_preview(update, context, collection_info, content_type, total_tracks):
@@ -601,23 +811,17 @@ async def send_collection_preview(update, context, collection_info, content_type
             await update.message.reply_text(caption)
             return
         
-        # Descargar imagen
-        response = requests.get(image_url)
-        if response.status_code != 200:
-            # Si falla la descarga de imagen, enviar solo texto
-            await update.message.reply_text(caption)
-            return
-        
-        # Crear objeto de bytes para la imagen
-        image_data = BytesIO(response.content)
-        image_data.name = f"{content_type}_cover.jpg"
-        
-        # Enviar imagen con caption
-        await context.bot.send_photo(
+        # Enviar imagen con caption (por file_id si ya se envió antes)
+        sent = await context.bot_data['artwork'].send_photo(
+            context.bot.send_photo,
+            image_url,
+            f"{content_type}_cover.jpg",
             chat_id=update.message.chat_id,
-            photo=image_data,
             caption=caption
         )
+        if sent is None:
+            # Si falla la descarga de imagen, enviar solo texto
+            await update.message.reply_text(caption)
         
     except Exception as e:
         logging.error(f"Error enviando vista previa: {str(e)}", exc_info=True)
@@ -627,12 +831,12 @@ async def send_collection_preview(update, context, collection_info, content_type
         except:
             pass
 
-async def search_content(dz, query, search_type='artist', limit=5):
+async def search_content(deezer, query, search_type='artist', limit=5):
     """
     Realiza una búsqueda en Deezer por artista, álbum o canción.
     
     Args:
-        dz: Instancia de Deezer
+        deezer: Fachada asíncrona DeezerAPI
         query: Término de búsqueda
         search_type: Tipo de búsqueda ('artist', 'album', 'track')
         limit: Número máximo de resultados
@@ -642,11 +846,11 @@ async def search_content(dz, query, search_type='artist', limit=5):
     """
     try:
         if search_type == 'artist':
-            results = dz.api.search_artist(query, limit=limit)
+            results = await deezer.search_artist(query, limit=limit)
         elif search_type == 'album':
-            results = dz.api.search_album(query, limit=limit)
+            results = await deezer.search_album(query, limit=limit)
         elif search_type == 'track':
-            results = dz.api.search_track(query, limit=limit)
+            results = await deezer.search_track(query, limit=limit)
         else:
             return []
         
@@ -686,8 +890,7 @@ async def process_search_callback(update, context):
         
         await query.edit_message_text(f"🔍 Buscando {search_type}: {search_query}...")
         
-        dz = context.bot_data.get('dz')
-        results = await search_content(dz, search_query, search_type)
+        results = await search_content(context.bot_data['deezer'], search_query, search_type)
         
         if not results:
             await query.edit_message_text(f"❌ No se encontraron resultados para: {search_query}")
@@ -819,10 +1022,10 @@ async def show_track_results(query, results):
 
 async def show_artist_info(query, context, artist_id):
     """Muestra la información del artista."""
-    dz = context.bot_data.get('dz')
+    deezer = context.bot_data['deezer']
     
     try:
-        artist_info = dz.api.get_artist(artist_id)
+        artist_info = await deezer.get_artist(artist_id)
         
         if not artist_info:
             # En lugar de editar, enviamos un nuevo mensaje
@@ -848,19 +1051,16 @@ async def show_artist_info(query, context, artist_id):
         image_sent = False
         if 'picture_big' in artist_info and artist_info['picture_big']:
             try:
-                response = requests.get(artist_info['picture_big'])
-                if response.status_code == 200:
-                    photo = BytesIO(response.content)
-                    photo.name = f"artist_{artist_id}.jpg"
-                    
-                    # Enviamos la foto como un nuevo mensaje
-                    await query.message.reply_photo(
-                        photo=photo,
-                        caption=text,
-                        reply_markup=reply_markup,
-                        parse_mode="Markdown"
-                    )
-                    image_sent = True
+                # Enviamos la foto como un nuevo mensaje (por file_id si ya se envió antes)
+                sent = await context.bot_data['artwork'].send_photo(
+                    query.message.reply_photo,
+                    artist_info['picture_big'],
+                    f"artist_{artist_id}.jpg",
+                    caption=text,
+                    reply_markup=reply_markup,
+                    parse_mode="Markdown"
+                )
+                image_sent = sent is not None
             except Exception as img_error:
                 logging.warning(f"Error al cargar la imagen del artista: {img_error}")
         
@@ -886,10 +1086,10 @@ async def show_artist_info(query, context, artist_id):
 
 async def show_artist_albums(query, context, artist_id):
     """Muestra los álbumes del artista."""
-    dz = context.bot_data.get('dz')
+    deezer = context.bot_data['deezer']
     
     try:
-        albums = dz.api.get_artist_albums(artist_id, limit=10)
+        albums = await deezer.get_artist_albums(artist_id, limit=10)
         
         if not albums or not albums.get('data'):
             # En lugar de editar el mensaje, enviamos uno nuevo
@@ -938,10 +1138,10 @@ async def show_artist_albums(query, context, artist_id):
 
 async def show_artist_top_tracks(query, context, artist_id):
     """Muestra las canciones más populares del artista."""
-    dz = context.bot_data.get('dz')
+    deezer = context.bot_data['deezer']
     
     try:
-        top_tracks = dz.api.get_artist_top_tracks(artist_id, limit=10)
+        top_tracks = await deezer.get_artist_top_tracks(artist_id, limit=10)
         
         if not top_tracks or not top_tracks.get('data'):
             # En lugar de editar el mensaje, enviamos uno nuevo
@@ -0,0 +1,165 @@
+import os
+import time
+import asyncio
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+from singleflight import SingleFlight
+
+DEEZER_API_WORKERS = int(os.environ.get("DEEZER_API_WORKERS", 4))  # Llamadas simultáneas a la API de Deezer
+DEEZER_API_TIMEOUT = float(os.environ.get("DEEZER_API_TIMEOUT", 15))  # Segundos máximos por llamada
+DEEZER_NEGATIVE_TTL = int(os.environ.get("DEEZER_NEGATIVE_TTL", 60))  # Segundos que se recuerda un resultado vacío
+
+# Caché por endpoint: (segundos de validez, entradas máximas)
+ENDPOINT_CACHE = {
+    "get_track": (24 * 3600, 2000),
+    "get_album": (6 * 3600, 500),
+    "get_album_tracks": (6 * 3600, 500),
+    "get_playlist": (600, 200),
+    "get_artist": (3600, 500),
+    "get_artist_albums": (3600, 500),
+    "get_artist_top": (3600, 500),
+    "search_artist": (600, 500),
+    "search_album": (600, 500),
+    "search_track": (600, 500),
+}
+
+class TTLCache:
+    """
+    Caché LRU acotada con caducidad por entrada.
+    
+    Los resultados vacíos se guardan con una validez menor (caché negativa)
+    para no repetir búsquedas sin resultados, pero sin ocultar por mucho
+    tiempo contenido que aparezca después.
+    """
+    
+    def __init__(self, ttl: float, max_entries: int, negative_ttl: float = DEEZER_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """Devuelve (encontrado, valor)."""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[1]
+    
+    def set(self, key: str, value: Any) -> None:
+        ttl = self.negative_ttl if _is_empty(value) else self.ttl
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 2) if total else 0,
+        }
+
+def _is_empty(value: Any) -> bool:
+    """Indica si una respuesta de la API no trae resultados."""
+    if not value:
+        return True
+    return isinstance(value, dict) and 'data' in value and not value['data']
+
+class DeezerAPI:
+    """
+    Fachada asíncrona de dz.api.
+    
+    Las llamadas de deezer-py son HTTP síncrono: aquí se ejecutan en un pool
+    acotado de hilos con timeout por llamada, y las llamadas idénticas que
+    coinciden en el tiempo comparten una sola petición. Las respuestas se
+    guardan en una caché por endpoint (ENDPOINT_CACHE) que no se comparte
+    entre endpoints, de modo que cada uno tiene su propia validez y tamaño.
+    """
+    
+    def __init__(self, dz, workers: int = DEEZER_API_WORKERS, timeout: float = DEEZER_API_TIMEOUT):
+        self._dz = dz
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="deezer-api")
+        self._inflight = SingleFlight("deezer-api")
+        self._caches = {
+            method: TTLCache(ttl, max_entries)
+            for method, (ttl, max_entries) in ENDPOINT_CACHE.items()
+        }
+        self.calls = 0
+        self.timeouts = 0
+    
+    async def _call(self, method: str, *args, **kwargs) -> Any:
+        """Ejecuta dz.api.<method>(*args, **kwargs) fuera del event loop."""
+        key = f"{method}:{args}:{sorted(kwargs.items())}"
+        cache: Optional[TTLCache] = self._caches.get(method)
+        if cache:
+            found, value = cache.get(key)
+            if found:
+                return value
+        
+        async def job():
+            self.calls += 1
+            loop = asyncio.get_running_loop()
+            call = functools.partial(getattr(self._dz.api, method), *args, **kwargs)
+            try:
+                value = await asyncio.wait_for(loop.run_in_executor(self._executor, call), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise TimeoutError(f"Deezer no respondió a {method} en {self.timeout:g}s")
+            if cache:
+                cache.set(key, value)
+            return value
+        
+        return await self._inflight.do(key, job)
+    
+    async def get_track(self, track_id) -> Dict[str, Any]:
+        return await self._call("get_track", str(track_id))
+    
+    async def get_album(self, album_id) -> Dict[str, Any]:
+        return await self._call("get_album", str(album_id))
+    
+    async def get_album_tracks(self, album_id) -> Dict[str, Any]:
+        return await self._call("get_album_tracks", str(album_id))
+    
+    async def get_playlist(self, playlist_id) -> Dict[str, Any]:
+        return await self._call("get_playlist", str(playlist_id))
+    
+    async def get_artist(self, artist_id) -> Dict[str, Any]:
+        return await self._call("get_artist", str(artist_id))
+    
+    async def get_artist_albums(self, artist_id, limit: int = 10) -> Dict[str, Any]:
+        return await self._call("get_artist_albums", str(artist_id), limit=limit)
+    
+    async def get_artist_top_tracks(self, artist_id, limit: int = 10) -> Dict[str, Any]:
+        return await self._call("get_artist_top", str(artist_id), limit=limit)
+    
+    async def search_artist(self, query: str, limit: int = 5) -> Dict[str, Any]:
+        return await self._call("search_artist", query, limit=limit)
+    
+    async def search_album(self, query: str, limit: int = 5) -> Dict[str, Any]:
+        return await self._call("search_album", query, limit=limit)
+    
+    async def search_track(self, query: str, limit: int = 5) -> Dict[str, Any]:
+        return await self._call("search_track", query, limit=limit)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve contadores de la fachada."""
+        return {
+            "workers": self.workers,
+            "calls": self.calls,
+            "timeouts": self.timeouts,
+            "shared": self._inflight.shared,
+            "cache": {method: cache.stats() for method, cache in self._caches.items()},
+        }
@@ -1,20 +1,269 @@
 import os
+import time
 import asyncio
 import logging
 import shutil
-from typing import Union, List
+import threading
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Union, List, Dict, Any, Optional
 from deezer import Deezer
 from deemix import generateDownloadObject
+import deemix.downloader
 from deemix.downloader import Downloader
 from deemix.settings import load, save
 
 DOWNLOAD_PATH = "./descargas"
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", 2))  # Descargas simultáneas de deemix
+DOWNLOAD_QUEUE_LIMIT = int(os.environ.get("DOWNLOAD_QUEUE_LIMIT", 20))  # Descargas en espera además de las activas
+DOWNLOAD_QUEUE_TIMEOUT = float(os.environ.get("DOWNLOAD_QUEUE_TIMEOUT", 30))  # Segundos que una descarga espera hueco antes de rechazarse
+DOWNLOAD_MODE = os.environ.get("DOWNLOAD_MODE", "thread").lower()  # "thread" o "process" (un proceso por worker)
+DEEMIX_ARTWORK_PATH = os.environ.get("DEEMIX_ARTWORK_PATH", "./artwork_cache/deemix")  # Carátulas para incrustar en las etiquetas
+DEEMIX_ARTWORK_MAX_BYTES = int(os.environ.get("DEEMIX_ARTWORK_MAX_BYTES", 100 * 1024 * 1024))  # Tamaño máximo en disco
+DEEMIX_ARTWORK_MIN_AGE = 600  # Segundos sin uso antes de poder desalojar una carátula (puede estar etiquetándose)
+
+# deemix guarda la carátula que incrusta en las etiquetas en TEMPDIR (alb{id}_{tamaño}.jpg) y la
+# reutiliza si ya existe. Se apunta a un directorio persistente y acotado compartido por todas
+# las descargas, y se hace atómica la escritura para que una descarga concurrente no lea una
+# imagen a medio escribir.
+_artwork_dir = Path(os.path.abspath(DEEMIX_ARTWORK_PATH))
+_artwork_dir.mkdir(parents=True, exist_ok=True)
+deemix.downloader.TEMPDIR = _artwork_dir
+_deemix_download_image = deemix.downloader.downloadImage
+# Un lock por grupo de carátulas para no descargar la misma dos veces a la vez
+_artwork_locks = [threading.Lock() for _ in range(64)]
+
+def _download_image_atomic(url, path, *args, **kwargs):
+    """Sustituto de deemix.downloader.downloadImage para las carátulas compartidas."""
+    path = Path(path)
+    if path.parent != _artwork_dir or ".tmp" in path.name:
+        return _deemix_download_image(url, path, *args, **kwargs)
+    
+    with _artwork_locks[hash(path.name) % len(_artwork_locks)]:
+        if path.is_file():
+            # Marcar como usada para el desalojo LRU
+            os.utime(path)
+            return path
+        tmp_path = path.with_name(f"{path.name}.tmp.{os.getpid()}.{threading.get_ident()}")
+        try:
+            result = _deemix_download_image(url, tmp_path, *args, **kwargs)
+            if result is None or not tmp_path.is_file():
+                return None
+            os.replace(tmp_path, path)
+            return path
+        finally:
+            if tmp_path.is_file():
+                tmp_path.unlink()
+
+deemix.downloader.downloadImage = _download_image_atomic
+
+def evict_artwork(max_bytes: int = DEEMIX_ARTWORK_MAX_BYTES) -> None:
+    """Borra las carátulas usadas hace más tiempo hasta respetar el tamaño máximo."""
+    entries = []
+    total = 0
+    for entry in os.scandir(_artwork_dir):
+        if not entry.is_file() or ".tmp" in entry.name:
+            continue
+        stat = entry.stat()
+        entries.append((stat.st_mtime, entry.path, stat.st_size))
+        total += stat.st_size
+    if total <= max_bytes:
+        return
+    
+    now = time.time()
+    for mtime, path, size in sorted(entries):
+        if total <= max_bytes or now - mtime < DEEMIX_ARTWORK_MIN_AGE:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
 
 class LogListener:
     def send(self, key, value=None):
         logging.debug(f"[DEEMIX] {key}: {value}")
 
-async def download_track(url: str, dz, settings, listener) -> Union[str, List[str]]:
+AUDIO_EXTENSIONS = ('.mp3', '.flac', '.m4a')
+
+class _CollectingListener:
+    """
+    Envuelve el listener de la aplicación y anota las rutas de los audios escritos.
+    
+    deemix notifica cada pista terminada con un evento updateQueue que incluye
+    downloadPath, así que no hace falta recorrer el directorio temporal para
+    encontrarlas.
+    """
+    
+    def __init__(self, listener):
+        self._listener = listener
+        self.paths: List[str] = []
+    
+    def send(self, key, value=None):
+        if key == "updateQueue" and isinstance(value, dict) and value.get('downloaded') and value.get('downloadPath'):
+            # Las pistas de una colección se descargan en varios hilos: append es atómico
+            self.paths.append(value['downloadPath'])
+        if self._listener:
+            self._listener.send(key, value)
+
+def _move_to_downloads(file_path: str) -> str:
+    """
+    Mueve un audio a DOWNLOAD_PATH sin pisar otro archivo con el mismo nombre.
+    
+    os.link falla si el destino ya existe, de modo que el nombre se reserva de
+    forma atómica sin comprobar antes su existencia (y sin carreras entre
+    descargas simultáneas); sólo en caso de colisión se prueba con un sufijo.
+    
+    Args:
+        file_path: Ruta del audio dentro del directorio temporal
+    
+    Returns:
+        La ruta final del audio
+    """
+    base_name, ext = os.path.splitext(os.path.basename(file_path))
+    target_path = os.path.join(DOWNLOAD_PATH, base_name + ext)
+    counter = 0
+    while True:
+        try:
+            os.link(file_path, target_path)
+        except FileExistsError:
+            counter += 1
+            target_path = os.path.join(DOWNLOAD_PATH, f"{base_name}_{counter}{ext}")
+            continue
+        except OSError:
+            # Sistema de archivos sin enlaces duros: mover sin más
+            shutil.move(file_path, target_path)
+            return target_path
+        os.remove(file_path)
+        return target_path
+
+class DownloadQueueFull(Exception):
+    """Se lanza cuando el pool de descargas está saturado."""
+
+class DownloadPool:
+    """
+    Pool dedicado y acotado para las descargas de deemix.
+    
+    Admite como mucho workers descargas en ejecución más queue_limit en
+    espera. Cuando está lleno, una nueva descarga espera hasta queue_timeout
+    segundos a que se libere un hueco (backpressure) y, si no lo hay, se
+    rechaza con DownloadQueueFull.
+    
+    En modo "process" cada worker es un proceso con su propia sesión de
+    Deezer (iniciada una vez con el ARL), de modo que el descifrado y el
+    etiquetado no bloquean el event loop del bot por el GIL.
+    """
+    
+    def __init__(self, workers: int = DOWNLOAD_WORKERS, queue_limit: int = DOWNLOAD_QUEUE_LIMIT,
+                 queue_timeout: float = DOWNLOAD_QUEUE_TIMEOUT, mode: str = DOWNLOAD_MODE,
+                 arl: Optional[str] = None):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self.mode = mode
+        if mode == "process":
+            if not arl:
+                raise ValueError("El modo de descarga por procesos necesita el ARL de Deezer")
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_download_worker,
+                initargs=(arl,)
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="deemix-download")
+        self._slots = asyncio.Semaphore(workers + queue_limit)
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+    
+    async def run(self, func, *args):
+        """
+        Ejecuta func(*args) en el pool respetando el límite de la cola.
+        
+        Raises:
+            DownloadQueueFull: si no hay hueco tras esperar queue_timeout segundos
+        """
+        if self._slots.locked() and self.queue_timeout <= 0:
+            self._reject()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout if self.queue_timeout > 0 else None)
+        except asyncio.TimeoutError:
+            self._reject()
+        
+        self._in_flight += 1
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._in_flight -= 1
+            self._slots.release()
+            raise
+        # El hueco se libera cuando termina el trabajo en el executor, aunque quien espera
+        # se cancele: el callback va en el futuro del executor, no en el envoltorio de asyncio
+        future.add_done_callback(lambda done: self._schedule_job_done(loop, done))
+        return await asyncio.wrap_future(future, loop=loop)
+    
+    def _schedule_job_done(self, loop, future) -> None:
+        """Lleva _job_done al event loop (el callback se ejecuta en el hilo del worker)."""
+        try:
+            loop.call_soon_threadsafe(self._job_done, future)
+        except RuntimeError:
+            # Event loop ya cerrado al apagar el bot
+            pass
+    
+    def _job_done(self, future) -> None:
+        self._in_flight -= 1
+        if future.cancelled() or future.exception():
+            self._failed += 1
+        else:
+            self._completed += 1
+        self._slots.release()
+    
+    def _reject(self):
+        self._rejected += 1
+        raise DownloadQueueFull("Hay demasiadas descargas en curso. Inténtalo de nuevo en unos minutos.")
+    
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve el estado del pool para dimensionarlo."""
+        active = min(self._in_flight, self.workers)
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "active": active,
+            "queued": self._in_flight - active,
+            "utilization": round(active / self.workers, 2) if self.workers else 0,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+        }
+    
+    def shutdown(self) -> None:
+        """Detiene el pool sin esperar a las descargas en curso."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+# Sesión de Deezer propia de cada proceso worker (modo "process")
+_worker_dz = None
+_worker_listener = None
+
+def _init_download_worker(arl: str) -> None:
+    """Inicializa un proceso worker: inicia sesión en Deezer una sola vez."""
+    global _worker_dz, _worker_listener
+    _worker_dz = Deezer()
+    if not _worker_dz.login_via_arl(arl):
+        logging.error("Fallo en la autenticación del worker de descargas: verifica tu ARL.")
+        raise Exception("Fallo en la autenticación: verifica tu ARL.")
+    _worker_listener = LogListener()
+    logging.info(f"Worker de descargas {os.getpid()} listo")
+
+def _worker_download_track(url: str, settings) -> Union[str, List[str]]:
+    """Descarga dentro de un proceso worker; sólo devuelve las rutas al proceso principal."""
+    return sync_download_track(url, _worker_dz, settings, _worker_listener)
+
+async def download_track(url: str, dz, settings, listener, pool: Optional[DownloadPool] = None) -> Union[str, List[str]]:
     """
     Descarga una pista, álbum o playlist de Deezer.
     
@@ -23,13 +272,23 @@ async def download_track(url: str, dz, settings, listener) -> Union[str, List[st
         dz: Instancia de Deezer autenticada
         settings: Configuración de descarga
         listener: Listener para logs
-        
+        pool: Pool de descargas de la aplicación (si no se indica, se usa el executor por defecto)
+    
     Returns:
         Ruta al archivo descargado o lista de rutas para álbumes/playlists
     """
+    if pool and pool.mode == "process":
+        # Los workers usan su propia sesión y listener; sólo viajan la URL y los settings
+        return await pool.run(_worker_download_track, url, dict(settings))
+    if pool:
+        return await pool.run(sync_download_track, url, dz, settings, listener)
     loop = asyncio.get_event_loop()
     return await loop.run_in_executor(None, sync_download_track, url, dz, settings, listener)
 
+def _downloaded_audio(collector: _CollectingListener) -> List[str]:
+    """Devuelve los audios que deemix notificó como descargados."""
+    return [path for path in collector.paths if path.endswith(AUDIO_EXTENSIONS) and os.path.isfile(path)]
+
 def sync_download_track(url: str, dz, settings, listener) -> Union[str, List[str]]:
     """
     Versión sincrónica de la función para descargar contenido de Deezer.
@@ -49,6 +308,10 @@ def sync_download_track(url: str, dz, settings, listener) -> Union[str, List[str
     # Guardar settings temporales para esta descarga
     temp_settings = settings.copy()
     temp_settings["downloadLocation"] = temp_dir
+    # Las carátulas sueltas (cover.jpg, artist.jpg) se borrarían con el directorio temporal:
+    # sólo se usa la incrustada, que se guarda en el directorio compartido de carátulas
+    temp_settings["saveArtwork"] = False
+    temp_settings["saveArtworkArtist"] = False
     
     try:
         # Al principio de sync_download_track
@@ -59,6 +322,7 @@ def sync_download_track(url: str, dz, settings, listener) -> Union[str, List[str
         bitrate = settings["maxBitrate"]
         plugins = {}  # Sin plugins adicionales
         download_obj = generateDownloadObject(dz, url, bitrate, plugins, listener)
+        collector = _CollectingListener(listener)
         
         # Después de generar download_obj - CORREGIDO el acceso a atributos
         try:
@@ -83,28 +347,14 @@ def sync_download_track(url: str, dz, settings, listener) -> Union[str, List[str
         if isinstance(download_obj, list):
             # Múltiples pistas (álbum o playlist)
             for obj in download_obj:
-                Downloader(dz, obj, temp_settings, listener).start()
+                Downloader(dz, obj, temp_settings, collector).start()
             
-            # Obtener lista de archivos descargados
+            # Mover a la carpeta principal de descargas los audios notificados por deemix
             downloaded_files = []
-            for root, _, files in os.walk(temp_dir):
-                for file in files:
-                    if file.endswith(('.mp3', '.flac', '.m4a')):
-                        file_path = os.path.join(root, file)
-                        
-                        # Generar nombre único para evitar sobrescribir archivos
-                        base_name, ext = os.path.splitext(file)
-                        target_file = file
-                        counter = 1
-                        while os.path.exists(os.path.join(DOWNLOAD_PATH, target_file)):
-                            target_file = f"{base_name}_{counter}{ext}"
-                            counter += 1
-                            
-                        # Mover a la carpeta principal de descargas
-                        target_path = os.path.join(DOWNLOAD_PATH, target_file)
-                        shutil.move(file_path, target_path)
-                        downloaded_files.append(target_path)
-                        logging.info(f"Archivo añadido a lista: {target_path}")
+            for file_path in _downloaded_audio(collector):
+                target_path = _move_to_downloads(file_path)
+                downloaded_files.append(target_path)
+                logging.info(f"Archivo añadido a lista: {target_path}")
             
             if not downloaded_files:
                 raise Exception("No se encontraron archivos de audio descargados.")
@@ -117,20 +367,14 @@ def sync_download_track(url: str, dz, settings, listener) -> Union[str, List[str
                 return downloaded_files
             # Para un solo track seleccionado de una lista, devolvemos el primero
             return downloaded_files[0]
-            
+        
         else:
             # Una sola pista
-            Downloader(dz, download_obj, temp_settings, listener).start()
+            Downloader(dz, download_obj, temp_settings, collector).start()
             
-            # Buscar archivo de audio descargado
-            for root, _, files in os.walk(temp_dir):
-                for file in files:
-                    if file.endswith(('.mp3', '.flac', '.m4a')):
-                        file_path = os.path.join(root, file)
-                        # Mover a la carpeta principal de descargas
-                        target_path = os.path.join(DOWNLOAD_PATH, file)
-                        shutil.move(file_path, target_path)
-                        return target_path
+            for file_path in _downloaded_audio(collector):
+                # Mover a la carpeta principal de descargas
+                return _move_to_downloads(file_path)
             
             raise Exception("No se encontró ningún archivo de audio descargado.")
     
@@ -139,13 +383,20 @@ def sync_download_track(url: str, dz, settings, listener) -> Union[str, List[str
         raise
     
     finally:
-        # Después de las descargas y antes de procesar los archivos
-        all_files = []
-        for root, _, files in os.walk(temp_dir):
-            for file in files:
-                all_files.append(os.path.join(root, file))
-        logging.info(f"Todos los archivos encontrados: {all_files}")
+        # Listar lo que quedó en el directorio temporal sólo al depurar
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            all_files = []
+            for root, _, files in os.walk(temp_dir):
+                for file in files:
+                    all_files.append(os.path.join(root, file))
+            logging.debug(f"Archivos restantes en el directorio temporal: {all_files}")
         
         # Limpiar directorio temporal
         if os.path.exists(temp_dir):
             shutil.rmtree(temp_dir, ignore_errors=True)
+        
+        # Mantener acotado el directorio compartido de carátulas
+        try:
+            evict_artwork()
+        except OSError as e:
+            logging.warning(f"No se pudo limpiar el directorio de carátulas: {str(e)}")
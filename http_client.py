@@ -0,0 +1,85 @@
+import os
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+import aiohttp
+
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 10))  # Segundos máximos por descarga de imagen
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 20))  # Conexiones abiertas a la vez
+HTTP_MAX_PER_HOST = int(os.environ.get("HTTP_MAX_PER_HOST", 10))  # Conexiones a la vez con un mismo host
+HTTP_MAX_BYTES = 10 * 1024 * 1024  # Tamaño máximo de una imagen descargada
+
+class HttpClient:
+    """
+    Cliente HTTP asíncrono compartido para descargar imágenes.
+    
+    Mantiene un pool de conexiones reutilizables (keep-alive) con límite de
+    conexiones simultáneas y timeout por petición, de modo que las descargas
+    no bloquean el event loop del bot.
+    """
+    
+    def __init__(self, timeout: float = HTTP_TIMEOUT, max_connections: int = HTTP_MAX_CONNECTIONS,
+                 max_per_host: int = HTTP_MAX_PER_HOST):
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.requests = 0
+        self.failures = 0
+    
+    async def start(self) -> None:
+        """Crea la sesión (debe llamarse dentro del event loop)."""
+        if self._session and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=self.max_per_host,
+            ttl_dns_cache=300,
+            keepalive_timeout=30
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+    
+    async def close(self) -> None:
+        """Cierra la sesión y sus conexiones."""
+        if self._session:
+            await self._session.close()
+            self._session = None
+    
+    async def get_bytes(self, url: str) -> Optional[bytes]:
+        """
+        Descarga el contenido de una URL.
+        
+        Args:
+            url: URL a descargar
+        
+        Returns:
+            El contenido, o None si la descarga falla o tarda demasiado
+        """
+        await self.start()
+        self.requests += 1
+        try:
+            async with self._session.get(url) as response:
+                if response.status != 200:
+                    self.failures += 1
+                    logging.warning(f"Respuesta {response.status} al descargar {url}")
+                    return None
+                if response.content_length and response.content_length > HTTP_MAX_BYTES:
+                    self.failures += 1
+                    logging.warning(f"Imagen demasiado grande: {url}")
+                    return None
+                return await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.failures += 1
+            logging.warning(f"No se pudo descargar {url}: {str(e) or type(e).__name__}")
+            return None
+    
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve contadores del cliente."""
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "max_connections": self.max_connections,
+        }
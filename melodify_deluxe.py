@@ -1,4 +1,5 @@
 import os
+import signal
 import asyncio
 import logging
 from dotenv import load_dotenv
@@ -21,10 +22,20 @@ load_dotenv()
 BOT_TOKEN = os.environ.get("TELEGRAM_TOKEN")
 DEEZER_AR = os.environ.get("DEEZER_AR")
 VAULT_CHATID = os.environ.get("VAULT_CHATID")
+# Chat auxiliar donde reenviar mensajes del canal del vault para reconstruirlo (opcional)
+VAULT_SYNC_SCRATCH_CHATID = os.environ.get("VAULT_SYNC_SCRATCH_CHATID")
 # Obtener el puerto de Render (o usar 8080 como predeterminado)
 PORT = int(os.environ.get("PORT", 8080))
 
-from downloader import LogListener
+from downloader import LogListener, DownloadPool
+from singleflight import SingleFlight
+from ratelimit import TelegramRateLimiter
+from http_client import HttpClient
+from artwork import ArtworkCache
+from audio_cache import AudioCache
+from deezer_api import DeezerAPI
+from vault import get_vault, load_vault
+from vault_sync import VaultImporter, ForwardingFeed
 from bot import start, handle_message, configuracion, config_callback, process_search_callback
 
 # Configuración del logging con formato claro
@@ -39,10 +50,12 @@ logging.getLogger("telegram").setLevel(logging.WARNING)
 logging.getLogger("deemix").setLevel(logging.INFO)
 
 # Crear la aplicación web
-async def create_web_app():
+async def create_web_app(bot_data=None):
     app = web.Application()
+    app['bot_data'] = bot_data or {}
     app.router.add_get('/', health_check)
     app.router.add_get('/ping', ping_handler)
+    app.router.add_get('/status', status_handler)
     return app
 
 # Endpoint simple para health checks
@@ -53,12 +66,44 @@ async def health_check(request):
 async def ping_handler(request):
     return web.Response(text="pong", status=200)
 
+# Endpoint con el estado interno del bot (pool de descargas, limitador...)
+async def status_handler(request):
+    status = {}
+    for name in ('download_pool', 'inflight', 'rate_limiter', 'http_client', 'artwork', 'audio_cache', 'deezer'):
+        component = request.app['bot_data'].get(name)
+        if component:
+            status[name] = component.stats()
+    return web.json_response(status)
+
 async def error_handler(update, context):
     """Maneja excepciones que ocurren en los handlers."""
     logging.error(f"Error al procesar la actualización {update}: {context.error}", exc_info=True)
     if update and update.effective_message:
         await update.effective_message.reply_text("⚠️ Ocurrió un error al procesar tu solicitud. Inténtalo de nuevo más tarde.")
 
+async def shutdown(app, runner, download_pool, http_client):
+    """Detiene el bot de forma ordenada y guarda las escrituras pendientes del vault."""
+    sync_task = app.bot_data.get('vault_sync_task')
+    if sync_task:
+        sync_task.cancel()
+    
+    steps = [
+        ("bot de Telegram", app.updater.stop),
+        ("bot de Telegram", app.stop),
+        ("bot de Telegram", app.shutdown),
+        # Las inserciones del vault se escriben de forma diferida: guardarlas antes de salir
+        ("vault", lambda: asyncio.to_thread(get_vault().flush)),
+        ("cliente HTTP", http_client.close),
+        ("servidor web", runner.cleanup),
+    ]
+    for name, step in steps:
+        try:
+            await step()
+        except Exception as e:
+            logging.error(f"Error al detener {name}: {str(e)}")
+    download_pool.shutdown()
+    logging.info("Bot detenido")
+
 async def main():
     try:
         # Verificar que las variables de entorno estén configuradas
@@ -81,13 +126,36 @@ async def main():
         
         listener = LogListener()
         
-        app = ApplicationBuilder().token(BOT_TOKEN).build()
+        # Pool dedicado para las descargas de deemix
+        download_pool = DownloadPool(arl=DEEZER_AR)
+        logging.info(f"Pool de descargas ({download_pool.mode}): {download_pool.workers} workers, cola de {download_pool.queue_limit}")
+        
+        # Cliente HTTP compartido para carátulas e imágenes
+        http_client = HttpClient()
+        await http_client.start()
+        
+        # Cargar el vault en memoria una sola vez al arrancar
+        get_vault().load()
+        
+        # Limitador central de peticiones a Telegram (presupuesto global y por chat, RetryAfter)
+        rate_limiter = TelegramRateLimiter()
+        app = ApplicationBuilder().token(BOT_TOKEN).rate_limiter(rate_limiter).build()
         
         # Guardar settings y componentes en el contexto del bot
         app.bot_data['settings'] = settings
         app.bot_data['dz'] = dz
+        # Consultas a la API de Deezer fuera del event loop
+        app.bot_data['deezer'] = DeezerAPI(dz)
         app.bot_data['listener'] = listener
         app.bot_data['vault_chat_id'] = VAULT_CHATID
+        app.bot_data['download_pool'] = download_pool
+        app.bot_data['rate_limiter'] = rate_limiter
+        app.bot_data['http_client'] = http_client
+        app.bot_data['artwork'] = ArtworkCache(http_client)
+        # Audios ya descargados, para no repetir la descarga al volver a subirlos (opcional)
+        app.bot_data['audio_cache'] = AudioCache()
+        # Descargas en curso por clave del vault, compartidas entre peticiones simultáneas
+        app.bot_data['inflight'] = SingleFlight("descargas")
         
         # Registrar handlers
         app.add_handler(CommandHandler("start", start))
@@ -108,7 +176,7 @@ async def main():
         await app.updater.start_polling()
         
         # Iniciar el servidor web para mantener vivo el servicio en Render
-        web_app = await create_web_app()
+        web_app = await create_web_app(app.bot_data)
         runner = web.AppRunner(web_app)
         await runner.setup()
         site = web.TCPSite(runner, '0.0.0.0', PORT)
@@ -117,9 +185,31 @@ async def main():
         logging.info(f"Servidor web iniciado en http://0.0.0.0:{PORT}")
         logging.info(f"Health check disponible en http://0.0.0.0:{PORT}/")
         logging.info(f"Endpoint de ping disponible en http://0.0.0.0:{PORT}/ping")
+        logging.info(f"Estado interno disponible en http://0.0.0.0:{PORT}/status")
+        
+        # Reconstruir el vault desde el historial del canal si se perdió (p.ej. disco efímero)
+        if VAULT_SYNC_SCRATCH_CHATID and VAULT_CHATID:
+            importer = VaultImporter(ForwardingFeed(app.bot, VAULT_CHATID, VAULT_SYNC_SCRATCH_CHATID))
+            if not load_vault():
+                logging.info("Vault vacío: iniciando sincronización con el historial del canal")
+                app.bot_data['vault_sync_task'] = asyncio.create_task(importer.run())
+            elif importer.pending():
+                # Un reinicio interrumpió la sincronización: se reanuda desde el checkpoint
+                logging.info("Reanudando la sincronización del vault interrumpida")
+                app.bot_data['vault_sync_task'] = asyncio.create_task(importer.run())
         
-        # Mantener la aplicación en ejecución
-        await asyncio.Event().wait()
+        # Mantener la aplicación en ejecución hasta recibir SIGTERM (Render) o SIGINT.
+        # atexit no se ejecuta con SIGTERM, así que el cierre ordenado se hace aquí
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:  # Windows
+                pass
+        await stop_event.wait()
+        logging.info("Señal de parada recibida, deteniendo el bot...")
+        await shutdown(app, runner, download_pool, http_client)
         
     except Exception as e:
         logging.critical(f"Error crítico: {str(e)}", exc_info=True)
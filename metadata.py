@@ -0,0 +1,63 @@
+from typing import Any, Dict, Optional
+
+class TrackMetadata:
+    """
+    Metadatos de una pista de Deezer para subirla al vault.
+    
+    Se construye a partir de la lista de pistas de un álbum/playlist o de la
+    respuesta de dz.api.get_track, de modo que los datos ya obtenidos no se
+    vuelven a pedir a la API.
+    """
+    
+    def __init__(self, track_id: Optional[str] = None, title: Optional[str] = None,
+                 performer: Optional[str] = None, duration: Optional[int] = None,
+                 isrc: Optional[str] = None, cover_url: Optional[str] = None):
+        self.track_id = track_id
+        self.title = title
+        self.performer = performer
+        self.duration = duration
+        self.isrc = isrc
+        self.cover_url = cover_url
+    
+    @classmethod
+    def from_deezer(cls, track: Dict[str, Any], album: Optional[Dict[str, Any]] = None) -> "TrackMetadata":
+        """
+        Crea los metadatos desde un objeto de pista de la API de Deezer.
+        
+        Args:
+            track: Pista de dz.api.get_track o de la lista de pistas de una colección
+            album: Álbum al que pertenece, si la pista no lo incluye (pistas de get_album)
+        """
+        album_info = track.get('album') or album or {}
+        return cls(
+            track_id=str(track['id']) if track.get('id') else None,
+            title=track.get('title'),
+            performer=(track.get('artist') or {}).get('name'),
+            duration=track.get('duration'),
+            isrc=track.get('isrc'),
+            cover_url=album_info.get('cover_medium') or album_info.get('cover_small'),
+        )
+    
+    def merge(self, other: Optional["TrackMetadata"]) -> "TrackMetadata":
+        """Completa los campos que faltan con los de other."""
+        if other:
+            for field in ('track_id', 'title', 'performer', 'duration', 'isrc', 'cover_url'):
+                if getattr(self, field) is None:
+                    setattr(self, field, getattr(other, field))
+        return self
+    
+    @property
+    def complete(self) -> bool:
+        """Indica si están todos los datos necesarios para subir la pista."""
+        return all(value is not None for value in (self.title, self.performer, self.duration, self.isrc, self.cover_url))
+    
+    async def load_cover(self, artwork) -> Optional[bytes]:
+        """
+        Devuelve la carátula (las pistas de un mismo álbum la comparten).
+        
+        Args:
+            artwork: ArtworkCache de la aplicación
+        """
+        if not self.cover_url:
+            return None
+        return await artwork.get_bytes(self.cover_url)
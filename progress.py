@@ -0,0 +1,78 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Optional
+from telegram.error import BadRequest
+
+STATUS_UPDATE_INTERVAL = float(os.environ.get("STATUS_UPDATE_INTERVAL", 3))  # Segundos mínimos entre ediciones del estado
+
+class ProgressReporter:
+    """
+    Mensaje de estado cuyas ediciones se agrupan y se limitan.
+    
+    Las actualizaciones que llegan en ráfaga se reducen a una edición como
+    mucho cada interval segundos (siempre con el texto más reciente), las que
+    no cambian el texto se omiten y el estado final se envía siempre.
+    """
+    
+    def __init__(self, message, interval: float = STATUS_UPDATE_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self._current: Optional[str] = getattr(message, "text", None)
+        self._pending: Optional[str] = None
+        self._last_edit = time.monotonic()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+    
+    @classmethod
+    async def create(cls, reply_to, text: str, interval: float = STATUS_UPDATE_INTERVAL) -> "ProgressReporter":
+        """
+        Envía el mensaje de estado inicial y devuelve su reporter.
+        
+        Args:
+            reply_to: Mensaje al que responder (update.message)
+            text: Texto inicial
+            interval: Segundos mínimos entre ediciones
+        """
+        message = await reply_to.reply_text(text)
+        reporter = cls(message, interval)
+        reporter._current = text
+        return reporter
+    
+    async def update(self, text: str) -> None:
+        """Actualiza el estado; la edición se aplaza si la anterior es reciente."""
+        self._pending = text
+        if self._flush_task and not self._flush_task.done():
+            return
+        delay = self._last_edit + self.interval - time.monotonic()
+        if delay <= 0:
+            await self._edit()
+        else:
+            self._flush_task = asyncio.create_task(self._flush_later(delay))
+    
+    async def finish(self, text: str) -> None:
+        """Muestra el estado final de inmediato, descartando las ediciones pendientes."""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        self._pending = text
+        await self._edit()
+    
+    async def _flush_later(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await self._edit()
+    
+    async def _edit(self) -> None:
+        async with self._lock:
+            text, self._pending = self._pending, None
+            if text is None or text == self._current:
+                return
+            try:
+                await self.message.edit_text(text)
+            except BadRequest as e:
+                # "Message is not modified" u otros errores de edición no deben cortar la descarga
+                logging.debug(f"No se pudo editar el mensaje de estado: {str(e)}")
+            except Exception as e:
+                logging.warning(f"No se pudo editar el mensaje de estado: {str(e)}")
+            self._current = text
+            self._last_edit = time.monotonic()
@@ -0,0 +1,181 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Callable, Coroutine, Dict, Optional, Union
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+TELEGRAM_GLOBAL_RATE = float(os.environ.get("TELEGRAM_GLOBAL_RATE", 30))  # Peticiones por segundo en total
+TELEGRAM_CHAT_RATE = float(os.environ.get("TELEGRAM_CHAT_RATE", 1))  # Mensajes por segundo en un chat privado
+TELEGRAM_CHAT_BURST = int(os.environ.get("TELEGRAM_CHAT_BURST", 3))  # Ráfaga permitida en un chat privado
+TELEGRAM_GROUP_RATE = float(os.environ.get("TELEGRAM_GROUP_RATE", 20))  # Mensajes por minuto en grupos y canales
+TELEGRAM_MAX_RETRIES = int(os.environ.get("TELEGRAM_MAX_RETRIES", 3))  # Reintentos tras un RetryAfter
+MAX_CHAT_BUCKETS = 1000  # Chats cuyo estado se conserva en memoria
+
+# Peticiones que no cuentan para los límites de envío
+UNLIMITED_ENDPOINTS = {"getUpdates", "getMe", "getFile", "answerCallbackQuery", "deleteWebhook", "getWebhookInfo"}
+
+class TokenBucket:
+    """
+    Cubo de tokens asíncrono.
+    
+    Se rellena a rate tokens por segundo hasta capacity. Tras un RetryAfter se
+    bloquea durante el tiempo indicado y reduce su ritmo a la mitad; cada
+    petición correcta lo recupera poco a poco hasta el ritmo configurado.
+    """
+    
+    def __init__(self, rate: float, capacity: float):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+    
+    def _refill(self, now: float) -> None:
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+    
+    async def acquire(self) -> None:
+        """Espera hasta disponer de un token y lo consume."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+    
+    def penalize(self, seconds: float) -> None:
+        """Bloquea el cubo tras un RetryAfter y reduce su ritmo."""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        # Al terminar el bloqueo se permite el reintento y el cubo se rellena desde ahí
+        self._tokens = 1
+        self._updated = self._blocked_until
+        self.rate = max(self.base_rate / 8, self.rate / 2)
+    
+    def reward(self) -> None:
+        """Recupera gradualmente el ritmo configurado tras una petición correcta."""
+        if self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate + self.base_rate / 20)
+    
+    @property
+    def idle(self) -> bool:
+        """Indica si el cubo está lleno y sin penalizaciones (se puede descartar)."""
+        now = time.monotonic()
+        self._refill(now)
+        return self._tokens >= self.capacity and now >= self._blocked_until and self.rate == self.base_rate
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """
+    Limitador de peticiones a la Bot API con presupuesto global y por chat.
+    
+    Todas las llamadas del bot (send_audio, reply_audio, edit_text,
+    send_photo...) pasan por aquí. Se respetan los límites de Telegram
+    (unos 30 mensajes/s en total, 1/s por chat privado y 20/min por grupo o
+    canal) y los RetryAfter se reintentan automáticamente tras esperar lo
+    indicado, frenando además el chat afectado.
+    """
+    
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE, chat_rate: float = TELEGRAM_CHAT_RATE,
+                 chat_burst: int = TELEGRAM_CHAT_BURST, group_rate: float = TELEGRAM_GROUP_RATE,
+                 max_retries: int = TELEGRAM_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: "OrderedDict[Union[int, str], TokenBucket]" = OrderedDict()
+        self.requests = 0
+        self.retries = 0
+    
+    async def initialize(self) -> None:
+        pass
+    
+    async def shutdown(self) -> None:
+        pass
+    
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket:
+            self._chats.move_to_end(chat_id)
+            return bucket
+        
+        # Los ids negativos (o @nombre) son grupos y canales
+        if (isinstance(chat_id, int) and chat_id < 0) or isinstance(chat_id, str):
+            bucket = TokenBucket(self.group_rate / 60, self.group_rate)
+        else:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+        self._chats[chat_id] = bucket
+        
+        # Descartar chats inactivos para no crecer sin límite
+        while len(self._chats) > MAX_CHAT_BUCKETS:
+            oldest_id, oldest = next(iter(self._chats.items()))
+            if not oldest.idle:
+                break
+            del self._chats[oldest_id]
+        return bucket
+    
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Any:
+        if endpoint in UNLIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+        
+        chat_id = data.get("chat_id")
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+        chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+        max_retries = rate_limit_args if rate_limit_args is not None else self.max_retries
+        
+        for attempt in range(max_retries + 1):
+            if chat_bucket:
+                await chat_bucket.acquire()
+            await self._global.acquire()
+            self.requests += 1
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == max_retries:
+                    logging.error(f"Límite de Telegram superado en {endpoint} tras {max_retries} reintentos")
+                    raise
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                self.retries += 1
+                logging.warning(f"RetryAfter en {endpoint} (chat {chat_id}): esperando {retry_after}s")
+                # Sin chat el límite es de todo el bot; con chat sólo se frena ese chat
+                (chat_bucket or self._global).penalize(retry_after + 0.1)
+                continue
+            
+            if chat_bucket:
+                chat_bucket.reward()
+            self._global.reward()
+            return result
+    
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve contadores y el ritmo actual del limitador."""
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "global_rate": round(self._global.rate, 2),
+            "chats": len(self._chats),
+            "throttled_chats": sum(1 for bucket in self._chats.values() if bucket.rate < bucket.base_rate),
+        }
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+class SingleFlight:
+    """
+    Registro de trabajos en curso para no repetir trabajos idénticos.
+    
+    El primer llamador de una clave lanza el trabajo; los que llegan mientras
+    sigue en curso esperan a su resultado en lugar de lanzar el suyo. El trabajo
+    se ejecuta como tarea independiente, de modo que si el primer llamador se
+    cancela los demás siguen recibiendo el resultado.
+    """
+    
+    def __init__(self, name: str = "singleflight"):
+        self.name = name
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.started = 0
+        self.shared = 0
+    
+    async def do(self, key: str, job: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Ejecuta job() una sola vez por clave mientras esté en curso.
+        
+        Args:
+            key: Clave que identifica el trabajo
+            job: Función sin argumentos que devuelve la corrutina a ejecutar
+        
+        Returns:
+            El resultado del trabajo (o propaga su excepción)
+        """
+        task = self._calls.get(key)
+        if task:
+            self.shared += 1
+            logging.info(f"[{self.name}] {key} ya en curso, esperando su resultado")
+        else:
+            self.started += 1
+            task = asyncio.ensure_future(job())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task)
+    
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Marcar la excepción como recuperada aunque ya no quede nadie esperando
+        if not task.cancelled() and task.exception():
+            logging.debug(f"[{self.name}] {key} terminó con error: {task.exception()}")
+    
+    def in_flight(self, key: str) -> bool:
+        """Indica si hay un trabajo en curso para la clave."""
+        return key in self._calls
+    
+    def stats(self) -> Dict[str, int]:
+        """Devuelve contadores de trabajos lanzados y compartidos."""
+        return {
+            "in_flight": len(self._calls),
+            "started": self.started,
+            "shared": self.shared,
+        }
@@ -1,12 +1,79 @@
 import json
 import os
+import atexit
+import heapq
 import logging
+import re
+import shutil
+import sqlite3
+import threading
 import time
-from typing import Dict, Any, Optional, List, Union
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Set, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 VAULT_JSON = "vault_data.json"
 VAULT_BACKUP = "vault_data.backup.json"
-MAX_VAULT_ENTRIES = 1000  # Limitar el vault a 1000 entradas
+VAULT_DB = "vault_data.db"
+VAULT_JOURNAL = "vault_data.journal.jsonl"
+VAULT_ACCESS = "vault_data.access.json"  # Metadatos de acceso de los motores de archivos planos
+VAULT_BACKEND = os.environ.get("VAULT_BACKEND", "journal")  # "journal", "json" o "sqlite"
+VAULT_JOURNAL_MAX_BYTES = int(os.environ.get("VAULT_JOURNAL_MAX_BYTES", 1024 * 1024))  # Tamaño que dispara la compactación
+# Límite de entradas del vault: SQLite sólo escribe las filas modificadas, así que admite un
+# vault mucho mayor que los motores de archivos planos, que releen y reescriben el snapshot completo
+MAX_VAULT_ENTRIES = int(os.environ.get("MAX_VAULT_ENTRIES", 100000 if VAULT_BACKEND == "sqlite" else 1000))
+VAULT_EVICTION = os.environ.get("VAULT_EVICTION", "lru")  # "lru", "lfu" o "size"
+VAULT_EVICTION_SLACK = 0.05  # Fracción extra que se libera al desalojar para no hacerlo en cada inserción
+VAULT_FLUSH_INTERVAL = float(os.environ.get("VAULT_FLUSH_INTERVAL", 5))  # Segundos entre escrituras diferidas
+VAULT_REFRESH_INTERVAL = float(os.environ.get("VAULT_REFRESH_INTERVAL", 2))  # Segundos mínimos entre relecturas por otros procesos
+# Calidad servida cuando la pista no está en caché con el bitrate pedido:
+# "exact" (ninguna), "better" (igual o superior) o "nearest" (superior y, si no hay, la inferior más cercana)
+VAULT_QUALITY_FALLBACK = os.environ.get("VAULT_QUALITY_FALLBACK", "better")
+
+# Niveles de calidad de menor a mayor (MP3_128, MP3_320, FLAC)
+QUALITY_TIERS = [1, 3, 9]
+
+# Claves de pistas individuales: "{track_id}_{bitrate}"
+TRACK_KEY_REGEX = re.compile(r'^(\d+)_(\d+)$')
+# Claves con calidad: pistas e índice secundario por ISRC ("isrc_{isrc}_{bitrate}")
+QUALITY_KEY_REGEX = re.compile(r'^(\d+|isrc_[A-Z0-9]+)_(\d+)$')
+
+def is_track_key(value: str) -> bool:
+    """Indica si un valor es una clave de pista individual del vault."""
+    return bool(TRACK_KEY_REGEX.match(value))
+
+def isrc_key(isrc: str, bitrate: Union[int, str]) -> str:
+    """
+    Clave del índice secundario ISRC -> file_id.
+    
+    La misma grabación aparece en Deezer con varios track_id (álbum,
+    recopilatorios, ediciones regionales) pero comparte ISRC.
+    """
+    return f"isrc_{isrc.upper()}_{bitrate}"
+
+def quality_candidates(bitrate: int, policy: str = VAULT_QUALITY_FALLBACK) -> List[int]:
+    """
+    Devuelve, en orden de preferencia, los bitrates alternativos aceptables.
+    
+    Args:
+        bitrate: Bitrate pedido
+        policy: Política de calidad ("exact", "better" o "nearest")
+        
+    Returns:
+        Lista de bitrates a probar después del pedido
+    """
+    if policy == "exact" or bitrate not in QUALITY_TIERS:
+        return []
+    tier = QUALITY_TIERS.index(bitrate)
+    candidates = QUALITY_TIERS[tier + 1:]
+    if policy == "nearest":
+        candidates += list(reversed(QUALITY_TIERS[:tier]))
+    return candidates
 
 def validate_vault_data(data: Dict[str, Any]) -> bool:
     """
@@ -34,26 +101,81 @@ def validate_vault_data(data: Dict[str, Any]) -> bool:
     
     return True
 
+@contextmanager
+def _file_lock(path: str):
+    """
+    Bloqueo consultivo entre procesos (y entre hilos) sobre "{path}.lock".
+    
+    Permite que varias instancias del bot o scripts de mantenimiento
+    compartan los archivos del vault sin pisarse las escrituras.
+    """
+    with open(f"{path}.lock", 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _atomic_write_json(path: str, data: Any, **dump_kwargs) -> None:
+    """Escribe un JSON en un archivo temporal y lo renombra, para no dejar nunca un archivo a medias."""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, **dump_kwargs)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _file_signature(*paths: str) -> Tuple:
+    """Firma (mtime, tamaño) de varios archivos para detectar cambios de otros procesos."""
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+def _apply_changes(data: Dict[str, Any], changed: Dict[str, Any], removed: Set[str]) -> Dict[str, Any]:
+    """Aplica un conjunto de cambios sobre una copia leída del disco."""
+    for key in removed:
+        data.pop(key, None)
+    data.update(changed)
+    return data
+
 def create_backup(data: Dict[str, Any]) -> None:
     """Crea una copia de seguridad del vault."""
     try:
-        with open(VAULT_BACKUP, 'w') as f:
-            json.dump(data, f, indent=4)
+        _atomic_write_json(VAULT_BACKUP, data, indent=4)
     except Exception as e:
         logging.error(f"Error creando backup del vault: {str(e)}")
 
-def load_vault() -> Dict[str, Any]:
+def _read_vault_file(path: str = VAULT_JSON, backup_path: str = VAULT_BACKUP) -> Dict[str, Any]:
     """
-    Carga los datos del vault desde el archivo JSON.
+    Lee y valida los datos del vault desde el archivo JSON.
+    
+    Args:
+        path: Ruta del archivo del vault
+        backup_path: Copia de seguridad a usar si el archivo está dañado
     
     Returns:
         Diccionario con los datos del vault, o un diccionario vacío si hay errores.
     """
     data = {}
     
-    if os.path.exists(VAULT_JSON):
+    if os.path.exists(path):
         try:
-            with open(VAULT_JSON, 'r') as f:
+            with open(path, 'r') as f:
                 data = json.load(f)
             
             # Validar datos
@@ -65,9 +187,9 @@ def load_vault() -> Dict[str, Any]:
         except json.JSONDecodeError:
             logging.error("Error decodificando JSON del vault")
             # Intentar recuperar desde backup
-            if os.path.exists(VAULT_BACKUP):
+            if os.path.exists(backup_path):
                 try:
-                    with open(VAULT_BACKUP, 'r') as f:
+                    with open(backup_path, 'r') as f:
                         data = json.load(f)
                     if validate_vault_data(data):
                         logging.info("Vault recuperado desde backup")
@@ -81,9 +203,930 @@ def load_vault() -> Dict[str, Any]:
     
     return data
 
+def _read_access_file(path: str = VAULT_ACCESS) -> Dict[str, List[float]]:
+    """Lee los metadatos de acceso guardados junto al vault JSON."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        logging.warning(f"No se pudieron leer los metadatos de acceso del vault: {str(e)}")
+        return {}
+
+def _write_access_file(access: Dict[str, List[float]], path: str = VAULT_ACCESS) -> None:
+    """Guarda los metadatos de acceso junto al vault JSON."""
+    try:
+        _atomic_write_json(path, access, separators=(",", ":"))
+    except Exception as e:
+        logging.error(f"Error guardando metadatos de acceso del vault: {str(e)}")
+
+def _journal_exists() -> bool:
+    """Indica si hay un journal (actual o rotado) con cambios sin compactar."""
+    return os.path.exists(VAULT_JOURNAL) or os.path.exists(f"{VAULT_JOURNAL}.1")
+
+def _write_vault_file(data: Dict[str, Any]) -> bool:
+    """Escribe los datos del vault en disco, creando antes la copia de seguridad."""
+    try:
+        # Crear backup primero
+        if os.path.exists(VAULT_JSON):
+            create_backup(data)
+        
+        # Guardar datos actualizados
+        _atomic_write_json(VAULT_JSON, data, indent=4)
+        return True
+    except Exception as e:
+        logging.error(f"Error guardando vault: {str(e)}")
+        return False
+
+class VaultStorage:
+    """
+    Interfaz de los motores de almacenamiento del vault.
+    
+    El vault en memoria entrega a cada motor tanto los cambios pendientes
+    (claves modificadas y eliminadas) como una copia completa de los datos,
+    de forma que cada motor escriba sólo lo que necesita. Los metadatos de
+    acceso de cada entrada ([último acceso, número de aciertos]) se
+    persisten igual que los valores.
+    """
+    
+    def load(self) -> Dict[str, Any]:
+        """Lee todas las entradas almacenadas."""
+        raise NotImplementedError
+    
+    def load_access(self) -> Dict[str, List[float]]:
+        """Lee los metadatos de acceso almacenados (se llama después de load)."""
+        return {}
+    
+    def has_external_changes(self) -> bool:
+        """Indica si otro proceso ha escrito desde la última lectura o escritura propia."""
+        return False
+    
+    def load_changes(self) -> Optional[Tuple[Dict[str, Any], Set[str], Dict[str, List[float]]]]:
+        """
+        Lee sólo lo que otros procesos han escrito desde la última lectura.
+        
+        Returns:
+            Tupla (entradas nuevas o modificadas, claves eliminadas, metadatos
+            de acceso leídos), o None si hay que volver a leerlo todo con load
+        """
+        return None
+    
+    def write(self, changed: Dict[str, Any], removed: Set[str], data: Dict[str, Any],
+              access_changed: Dict[str, List[float]], access: Dict[str, List[float]]) -> bool:
+        """
+        Persiste los cambios pendientes.
+        
+        Args:
+            changed: Entradas nuevas o modificadas
+            removed: Claves eliminadas
+            data: Copia completa del vault tras aplicar los cambios
+            access_changed: Metadatos de acceso modificados
+            access: Copia completa de los metadatos de acceso
+            
+        Returns:
+            True si se guardó correctamente, False en caso contrario
+        """
+        raise NotImplementedError
+
+class JsonVaultStorage(VaultStorage):
+    """
+    Motor original: reescribe vault_data.json completo en cada escritura.
+    
+    Cada escritura aplica los cambios propios sobre el contenido actual del
+    disco en vez de sobrescribirlo, así que no se pierde lo que otros
+    procesos hayan escrito desde la última lectura.
+    """
+    
+    def __init__(self):
+        self._signature: Optional[Tuple] = None
+    
+    def load(self) -> Dict[str, Any]:
+        with _file_lock(VAULT_JSON):
+            self._merge_journal()
+            self._signature = _file_signature(VAULT_JSON, VAULT_ACCESS)
+            return _read_vault_file()
+    
+    def _merge_journal(self) -> None:
+        """Incorpora al archivo el journal que haya dejado el motor journal (requiere el bloqueo de archivo)."""
+        if not _journal_exists():
+            return
+        
+        journal = JournalVaultStorage()
+        data = journal.load()
+        if not _write_vault_file(data):
+            return
+        _write_access_file({key: meta for key, meta in journal.load_access().items() if key in data})
+        for path in (VAULT_JOURNAL, f"{VAULT_JOURNAL}.1"):
+            if os.path.exists(path):
+                os.remove(path)
+        logging.info(f"Journal del vault incorporado al vault JSON: {len(data)} entradas")
+    
+    def load_access(self) -> Dict[str, List[float]]:
+        return _read_access_file()
+    
+    def has_external_changes(self) -> bool:
+        return _file_signature(VAULT_JSON, VAULT_ACCESS) != self._signature
+    
+    def load_changes(self) -> Optional[Tuple[Dict[str, Any], Set[str], Dict[str, List[float]]]]:
+        # El archivo se reescribe completo: sólo se evita releerlo si únicamente
+        # cambiaron los metadatos de acceso
+        with _file_lock(VAULT_JSON):
+            signature = _file_signature(VAULT_JSON, VAULT_ACCESS)
+            if self._signature is None or signature[0] != self._signature[0]:
+                return None
+            self._signature = signature
+        return {}, set(), {}
+    
+    def write(self, changed: Dict[str, Any], removed: Set[str], data: Dict[str, Any],
+              access_changed: Dict[str, List[float]], access: Dict[str, List[float]]) -> bool:
+        with _file_lock(VAULT_JSON):
+            external = self.has_external_changes()
+            # Los cambios se aplican siempre sobre el contenido actual del disco, nunca
+            # sobre la copia en memoria, que puede no incluir lo escrito por otros procesos
+            data = _apply_changes(_read_vault_file(), changed, removed)
+            access = _read_access_file()
+            access.update(access_changed)
+            access = {key: meta for key, meta in access.items() if key in data}
+            
+            if changed or removed:
+                if not _write_vault_file(data):
+                    return False
+            _write_access_file(access)
+            # Si otro proceso también escribió, se deja la firma antigua para que se relea
+            if not external:
+                self._signature = _file_signature(VAULT_JSON, VAULT_ACCESS)
+        return True
+
+class JournalVaultStorage(VaultStorage):
+    """
+    Motor de archivos planos con journal de sólo anexado.
+    
+    vault_data.json actúa como snapshot y cada cambio se anexa como una línea
+    JSONL al journal, así que una escritura cuesta lo mismo sin importar el
+    tamaño del vault. Cuando el journal supera VAULT_JOURNAL_MAX_BYTES, un
+    hilo en segundo plano lo fusiona en un nuevo snapshot; el snapshot
+    anterior pasa a ser el backup. Al arrancar se reproduce el journal sobre
+    el snapshot para recuperar los cambios no compactados.
+    
+    Los anexados y la compactación se serializan con un bloqueo de archivo,
+    así que varios procesos pueden compartir el mismo journal: la
+    compactación parte del snapshot en disco y reproduce el journal rotado,
+    sin depender del contenido en memoria de ningún proceso.
+    """
+    
+    def __init__(self, snapshot_path: str = VAULT_JSON, journal_path: str = VAULT_JOURNAL,
+                 max_journal_bytes: int = VAULT_JOURNAL_MAX_BYTES):
+        self._snapshot_path = snapshot_path
+        # Backup y metadatos de acceso van junto al snapshot, con los mismos nombres que en el motor JSON
+        base_path = os.path.splitext(snapshot_path)[0]
+        self._backup_path = f"{base_path}.backup.json"
+        self._access_path = f"{base_path}.access.json"
+        self._journal_path = journal_path
+        self._rotated_path = f"{journal_path}.1"
+        self._max_journal_bytes = max_journal_bytes
+        self._lock = threading.Lock()
+        self._compactor: Optional[threading.Thread] = None
+        self._access: Dict[str, List[float]] = {}
+        self._signature: Optional[Tuple] = None
+        # Snapshot y journal rotado ya leídos, y bytes del journal ya reproducidos
+        self._base_signature: Optional[Tuple] = None
+        self._offset = 0
+    
+    def load(self) -> Dict[str, Any]:
+        with _file_lock(self._journal_path):
+            data = _read_vault_file(self._snapshot_path, self._backup_path)
+            self._access = _read_access_file(self._access_path)
+            # Un journal rotado sólo existe si hay una compactación en curso o que no terminó
+            replayed = self._replay(self._rotated_path, data, self._access)[0]
+            count, self._offset = self._replay(self._journal_path, data, self._access)
+            replayed += count
+            self._base_signature = self._base_signature_now()
+            self._signature = self._current_signature()
+        if replayed:
+            logging.info(f"Journal del vault reproducido: {replayed} cambios")
+        return data
+    
+    def load_access(self) -> Dict[str, List[float]]:
+        return self._access
+    
+    def has_external_changes(self) -> bool:
+        return self._current_signature() != self._signature
+    
+    def load_changes(self) -> Optional[Tuple[Dict[str, Any], Set[str], Dict[str, List[float]]]]:
+        # Mientras nadie compacte, los cambios ajenos son las líneas anexadas al journal
+        # después de las ya reproducidas
+        with self._lock, _file_lock(self._journal_path):
+            if self._base_signature is None or self._base_signature_now() != self._base_signature:
+                return None
+            if self._journal_size() < self._offset:
+                return None
+            changed: Dict[str, Any] = {}
+            removed: Set[str] = set()
+            access: Dict[str, List[float]] = {}
+            self._offset = self._replay(self._journal_path, changed, access, offset=self._offset, removed=removed)[1]
+            self._signature = self._current_signature()
+        return changed, removed, access
+    
+    def _current_signature(self) -> Tuple:
+        return _file_signature(self._snapshot_path, self._rotated_path, self._journal_path)
+    
+    def _base_signature_now(self) -> Tuple:
+        return _file_signature(self._snapshot_path, self._rotated_path)
+    
+    def _journal_size(self) -> int:
+        try:
+            return os.path.getsize(self._journal_path)
+        except FileNotFoundError:
+            return 0
+    
+    def write(self, changed: Dict[str, Any], removed: Set[str], data: Dict[str, Any],
+              access_changed: Dict[str, List[float]], access: Dict[str, List[float]]) -> bool:
+        lines = [json.dumps({"k": key, "d": True}) for key in removed]
+        for key, value in changed.items():
+            record = {"k": key, "v": value}
+            if key in access_changed:
+                record["a"] = access_changed[key]
+            lines.append(json.dumps(record))
+        lines += [
+            json.dumps({"k": key, "a": meta})
+            for key, meta in access_changed.items() if key not in changed
+        ]
+        try:
+            with self._lock, _file_lock(self._journal_path):
+                external = self.has_external_changes()
+                with open(self._journal_path, 'a') as f:
+                    f.write("\n".join(lines) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                if os.path.getsize(self._journal_path) >= self._max_journal_bytes:
+                    self._start_compaction()
+                # Si otro proceso también escribió, se deja la firma antigua para que se relea
+                if not external:
+                    self._signature = self._current_signature()
+                    self._base_signature = self._base_signature_now()
+                    self._offset = self._journal_size()
+            return True
+        except Exception as e:
+            logging.error(f"Error escribiendo journal del vault: {str(e)}")
+            return False
+    
+    def _replay(self, path: str, data: Dict[str, Any], access: Dict[str, List[float]],
+                offset: int = 0, removed: Optional[Set[str]] = None) -> Tuple[int, int]:
+        """
+        Aplica sobre data y access los cambios registrados en un journal.
+        
+        Args:
+            path: Ruta del journal
+            data: Entradas sobre las que aplicar los cambios
+            access: Metadatos de acceso sobre los que aplicar los cambios
+            offset: Byte desde el que leer (para reproducir sólo lo nuevo)
+            removed: Si se indica, recoge las claves eliminadas
+        
+        Returns:
+            Tupla (cambios aplicados, byte hasta el que se ha leído)
+        """
+        if not os.path.exists(path):
+            return 0, 0
+        
+        count = 0
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Línea a medio escribir: se leerá completa la próxima vez
+                    break
+                offset += len(line)
+                try:
+                    record = json.loads(line)
+                    key = record["k"]
+                    if record.get("d"):
+                        data.pop(key, None)
+                        access.pop(key, None)
+                        if removed is not None:
+                            removed.add(key)
+                    elif "v" in record and validate_vault_data({key: record["v"]}):
+                        data[key] = record["v"]
+                        if removed is not None:
+                            removed.discard(key)
+                    if "a" in record:
+                        access[key] = record["a"]
+                    count += 1
+                except (json.JSONDecodeError, UnicodeDecodeError, KeyError, TypeError):
+                    # Normalmente la última línea de una escritura interrumpida
+                    logging.warning(f"Línea del journal del vault ignorada (byte {offset - len(line)})")
+        return count, offset
+    
+    def _start_compaction(self) -> None:
+        """Rota el journal y lanza la compactación en segundo plano (requiere self._lock y el bloqueo de archivo)."""
+        if self._compactor and self._compactor.is_alive():
+            return
+        
+        # Las escrituras posteriores van a un journal nuevo
+        if os.path.exists(self._rotated_path):
+            # Una compactación anterior falló: se acumula el journal actual sobre el rotado
+            with open(self._journal_path, 'r') as src, open(self._rotated_path, 'a') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(self._journal_path)
+        else:
+            os.replace(self._journal_path, self._rotated_path)
+        self._compactor = threading.Thread(target=self._compact, name="vault-compactor", daemon=True)
+        self._compactor.start()
+    
+    def _compact(self) -> None:
+        """Fusiona el journal rotado con el snapshot en disco y lo descarta."""
+        try:
+            # Mismo orden de bloqueo que write: primero el del hilo, luego el de archivo
+            with self._lock, _file_lock(self._journal_path):
+                if not os.path.exists(self._rotated_path):
+                    # Otro proceso ya la completó
+                    return
+                external = self.has_external_changes()
+                data = _read_vault_file(self._snapshot_path, self._backup_path)
+                access = _read_access_file(self._access_path)
+                self._replay(self._rotated_path, data, access)
+                
+                _write_access_file({key: meta for key, meta in access.items() if key in data}, self._access_path)
+                tmp_path = f"{self._snapshot_path}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(data, f, separators=(",", ":"))
+                    f.flush()
+                    os.fsync(f.fileno())
+                
+                # El snapshot anterior se conserva como backup en lugar de escribir otra copia
+                if os.path.exists(self._snapshot_path):
+                    os.replace(self._snapshot_path, self._backup_path)
+                os.replace(tmp_path, self._snapshot_path)
+                os.remove(self._rotated_path)
+                
+                # La compactación no cambia el contenido: sólo obliga a releer si ya había cambios ajenos
+                if not external:
+                    self._signature = self._current_signature()
+                    self._base_signature = self._base_signature_now()
+            logging.info(f"Vault compactado: {len(data)} entradas")
+        except Exception as e:
+            logging.error(f"Error compactando el vault: {str(e)}")
+
+class SqliteVaultStorage(VaultStorage):
+    """
+    Motor SQLite con la clave como índice primario y journal en modo WAL.
+    
+    Cada escritura aplica sólo las entradas modificadas dentro de una única
+    transacción, por lo que su coste no depende del tamaño del vault.
+    
+    Cada transacción que cambia valores incrementa un número de revisión que
+    se guarda en las filas modificadas y en las marcas de las claves
+    eliminadas (tabla vault_removed), así que otro proceso puede leer sólo
+    lo cambiado desde la última revisión que vio. Las escrituras de sólo
+    metadatos de acceso no cambian la revisión.
+    """
+    
+    # Revisiones durante las que se conservan las marcas de claves eliminadas
+    TOMBSTONE_REVISIONS = 10000
+    
+    def __init__(self, path: str = VAULT_DB):
+        self._path = path
+        self._lock = threading.Lock()
+        # timeout: esperar a que otro proceso libere la base de datos en lugar de fallar
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vault (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID"
+        )
+        # Columnas de metadatos de acceso y de revisión (añadidas a bases de datos anteriores)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(vault)")}
+        if "last_access" not in columns:
+            self._conn.execute("ALTER TABLE vault ADD COLUMN last_access REAL NOT NULL DEFAULT 0")
+        if "hits" not in columns:
+            self._conn.execute("ALTER TABLE vault ADD COLUMN hits INTEGER NOT NULL DEFAULT 0")
+        if "rev" not in columns:
+            self._conn.execute("ALTER TABLE vault ADD COLUMN rev INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS vault_rev ON vault (rev)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vault_removed (key TEXT PRIMARY KEY, rev INTEGER NOT NULL) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vault_meta "
+            "(id INTEGER PRIMARY KEY CHECK (id = 0), rev INTEGER NOT NULL, pruned_rev INTEGER NOT NULL)"
+        )
+        self._conn.execute("INSERT OR IGNORE INTO vault_meta (id, rev, pruned_rev) VALUES (0, 0, 0)")
+        self._conn.commit()
+        self._access: Dict[str, List[float]] = {}
+        self._data_version: Optional[int] = None
+        self._rev: Optional[int] = None
+    
+    @contextmanager
+    def _snapshot(self):
+        """Transacción de lectura: todas las consultas ven el mismo estado (requiere self._lock)."""
+        self._conn.execute("BEGIN")
+        try:
+            yield
+        finally:
+            self._conn.commit()
+    
+    def _read_revision(self) -> Tuple[int, int]:
+        return self._conn.execute("SELECT rev, pruned_rev FROM vault_meta").fetchone()
+    
+    def load(self) -> Dict[str, Any]:
+        with self._lock:
+            # Antes de leer: un cambio confirmado entretanto se volverá a comprobar, no se pierde
+            self._data_version = self._current_data_version()
+            with self._snapshot():
+                rows = self._conn.execute("SELECT key, value, last_access, hits FROM vault").fetchall()
+                self._rev = self._read_revision()[0]
+        
+        data = {}
+        self._access = {}
+        for key, value, last_access, hits in rows:
+            try:
+                data[key] = json.loads(value)
+                self._access[key] = [last_access, hits]
+            except json.JSONDecodeError:
+                logging.warning(f"Entrada corrupta en el vault SQLite: {key}")
+        
+        # Migrar el vault de archivos planos la primera vez que se usa SQLite; se
+        # carga como lo haría el motor journal para no perder los cambios sin compactar
+        if not data and (os.path.exists(VAULT_JSON) or _journal_exists()):
+            journal = JournalVaultStorage()
+            data = journal.load()
+            self._access = {key: meta for key, meta in journal.load_access().items() if key in data}
+            if data and self.write(data, set(), data, self._access, self._access):
+                logging.info(f"Vault JSON migrado a SQLite: {len(data)} entradas")
+        
+        return data
+    
+    def load_access(self) -> Dict[str, List[float]]:
+        return self._access
+    
+    def has_external_changes(self) -> bool:
+        with self._lock:
+            return self._current_data_version() != self._data_version
+    
+    def load_changes(self) -> Optional[Tuple[Dict[str, Any], Set[str], Dict[str, List[float]]]]:
+        with self._lock:
+            data_version = self._current_data_version()
+            with self._snapshot():
+                rev, pruned_rev = self._read_revision()
+                if self._rev is None or self._rev < pruned_rev:
+                    # Ya no se conservan todas las eliminaciones desde la última lectura
+                    return None
+                rows = self._conn.execute(
+                    "SELECT key, value, last_access, hits FROM vault WHERE rev > ?", (self._rev,)
+                ).fetchall()
+                removed = {
+                    key for (key,) in self._conn.execute(
+                        "SELECT key FROM vault_removed WHERE rev > ?", (self._rev,)
+                    )
+                }
+            self._rev = rev
+            self._data_version = data_version
+        
+        changed = {}
+        access = {}
+        for key, value, last_access, hits in rows:
+            try:
+                changed[key] = json.loads(value)
+                access[key] = [last_access, hits]
+            except json.JSONDecodeError:
+                logging.warning(f"Entrada corrupta en el vault SQLite: {key}")
+        return changed, removed, access
+    
+    def _current_data_version(self) -> int:
+        # Cambia sólo cuando otra conexión confirma una transacción
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+    
+    def write(self, changed: Dict[str, Any], removed: Set[str], data: Dict[str, Any],
+              access_changed: Dict[str, List[float]], access: Dict[str, List[float]]) -> bool:
+        # Cada escritura sólo toca sus propias claves, así que los cambios de
+        # otros procesos se conservan sin necesidad de fusionar
+        try:
+            with self._lock:
+                rev = self._write_changes(changed, removed, access_changed, access)
+                # Si nadie más escribió entretanto, lo escrito ya está visto
+                if rev is not None and self._rev == rev - 1:
+                    self._rev = rev
+            return True
+        except sqlite3.Error as e:
+            logging.error(f"Error guardando vault en SQLite: {str(e)}")
+            return False
+    
+    def _write_changes(self, changed: Dict[str, Any], removed: Set[str], access_changed: Dict[str, List[float]],
+                       access: Dict[str, List[float]]) -> Optional[int]:
+        """Aplica los cambios en una transacción y devuelve su revisión, si cambió valores (requiere self._lock)."""
+        with self._conn:
+            rev = None
+            if changed or removed:
+                # El UPDATE toma el bloqueo de escritura: las revisiones no se repiten entre procesos
+                self._conn.execute("UPDATE vault_meta SET rev = rev + 1")
+                rev = self._read_revision()[0]
+            if removed:
+                self._conn.executemany(
+                    "DELETE FROM vault WHERE key = ?",
+                    [(key,) for key in removed]
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO vault_removed (key, rev) VALUES (?, ?)",
+                    [(key, rev) for key in removed]
+                )
+            if changed:
+                self._conn.executemany(
+                    "INSERT INTO vault (key, value, last_access, hits, rev) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value, "
+                    "last_access = excluded.last_access, hits = excluded.hits, rev = excluded.rev",
+                    [
+                        (key, json.dumps(value), *access.get(key, [0, 0]), rev)
+                        for key, value in changed.items()
+                    ]
+                )
+                self._conn.executemany(
+                    "DELETE FROM vault_removed WHERE key = ?",
+                    [(key,) for key in changed]
+                )
+            access_only = [
+                (meta[0], meta[1], key)
+                for key, meta in access_changed.items() if key not in changed
+            ]
+            if access_only:
+                self._conn.executemany(
+                    "UPDATE vault SET last_access = ?, hits = ? WHERE key = ?",
+                    access_only
+                )
+            if rev is not None and rev % 100 == 0 and rev > self.TOMBSTONE_REVISIONS:
+                # Olvidar las marcas antiguas; quien no haya leído desde entonces relee todo
+                pruned_rev = rev - self.TOMBSTONE_REVISIONS
+                self._conn.execute("DELETE FROM vault_removed WHERE rev <= ?", (pruned_rev,))
+                self._conn.execute("UPDATE vault_meta SET pruned_rev = ?", (pruned_rev,))
+        return rev
+
+def create_storage(backend: str = VAULT_BACKEND) -> VaultStorage:
+    """Crea el motor de almacenamiento configurado en VAULT_BACKEND."""
+    if backend == "sqlite":
+        return SqliteVaultStorage()
+    if backend == "json":
+        return JsonVaultStorage()
+    if backend != "journal":
+        logging.warning(f"Motor de vault desconocido '{backend}', usando journal")
+    return JournalVaultStorage()
+
+class Vault:
+    """
+    Índice residente del vault.
+    
+    Los datos se leen del motor de almacenamiento una sola vez y las
+    consultas se resuelven en memoria. Las modificaciones se acumulan y se
+    escriben de forma diferida (write-behind) tras VAULT_FLUSH_INTERVAL
+    segundos, agrupando varias inserciones en una sola escritura.
+    
+    Cada entrada lleva sus metadatos de acceso ([último acceso, aciertos]);
+    al superar MAX_VAULT_ENTRIES se desalojan las entradas con menor
+    puntuación según la política configurada en VAULT_EVICTION.
+    """
+    
+    def __init__(self, storage: Optional[VaultStorage] = None, flush_interval: float = VAULT_FLUSH_INTERVAL,
+                 max_entries: int = MAX_VAULT_ENTRIES, eviction: str = VAULT_EVICTION):
+        self._lock = threading.RLock()
+        self._storage = storage
+        self._data: Dict[str, Any] = {}
+        self._access: Dict[str, List[float]] = {}
+        self._loaded = False
+        self._changed: Dict[str, Any] = {}
+        self._removed: Set[str] = set()
+        self._access_changed: Dict[str, List[float]] = {}
+        self._flush_interval = flush_interval
+        self._flush_timer: Optional[threading.Timer] = None
+        self._max_entries = max_entries
+        self._eviction = eviction
+        self._bitrates: Dict[str, Set[int]] = {}  # track_id o "isrc_{isrc}" -> bitrates en caché
+        self._last_refresh = 0.0
+    
+    def load(self) -> None:
+        """Carga el vault desde el motor de almacenamiento si todavía no está en memoria."""
+        with self._lock:
+            if self._loaded:
+                return
+            if self._storage is None:
+                self._storage = create_storage()
+            self._data = self._storage.load()
+            stored_access = self._storage.load_access()
+            # Las entradas sin metadatos (vaults antiguos) cuentan como nunca usadas
+            self._access = {key: list(stored_access.get(key, [0, 0])) for key in self._data}
+            self._loaded = True
+            self._rebuild_bitrate_index()
+            logging.info(f"Vault cargado en memoria: {len(self._data)} entradas")
+            self._migrate_collections()
+    
+    def get(self, key: str) -> Optional[Union[str, List[str]]]:
+        """Obtiene una entrada desde memoria y registra el acierto."""
+        self.load()
+        value = self._data.get(key)
+        if value is None and self.refresh():
+            # Otro proceso pudo haberla guardado
+            value = self._data.get(key)
+        if value is not None:
+            with self._lock:
+                meta = self._access.get(key)
+                if meta is not None:
+                    meta[0] = time.time()
+                    meta[1] += 1
+                    self._access_changed[key] = list(meta)
+                    self._schedule_flush()
+        return value
+    
+    def find_track(self, track_id: str, bitrate: int,
+                   policy: str = VAULT_QUALITY_FALLBACK) -> Tuple[Optional[str], Optional[int]]:
+        """
+        Busca el file_id de una pista, recurriendo a otras calidades en caché.
+        
+        Args:
+            track_id: ID de la pista de Deezer (o "isrc_{isrc}" para el índice por ISRC)
+            bitrate: Bitrate pedido
+            policy: Política de calidad ("exact", "better" o "nearest")
+            
+        Returns:
+            Tupla (file_id de la mejor calidad aceptable en caché, bitrate con el
+            que está guardado), o (None, None)
+        """
+        value = self.get(f"{track_id}_{bitrate}")
+        if value is not None:
+            return value, bitrate
+        
+        # refresh() puede sustituir el índice desde otro hilo
+        with self._lock:
+            cached = set(self._bitrates.get(str(track_id), ()))
+        if not cached:
+            return None, None
+        for candidate in quality_candidates(bitrate, policy):
+            if candidate in cached:
+                logging.info(f"Pista {track_id} servida con calidad {candidate} en lugar de {bitrate}")
+                return self.get(f"{track_id}_{candidate}"), candidate
+        return None, None
+    
+    def get_track(self, track_id: str, bitrate: int, policy: str = VAULT_QUALITY_FALLBACK) -> Optional[str]:
+        """
+        Obtiene el file_id de una pista, recurriendo a otras calidades en caché.
+        
+        Args:
+            track_id: ID de la pista de Deezer (o "isrc_{isrc}" para el índice por ISRC)
+            bitrate: Bitrate pedido
+            policy: Política de calidad ("exact", "better" o "nearest")
+            
+        Returns:
+            File ID de la mejor calidad aceptable en caché, o None
+        """
+        return self.find_track(track_id, bitrate, policy)[0]
+    
+    def set(self, key: str, value: Union[str, List[str]]) -> None:
+        """Añade o reemplaza una entrada y programa su escritura diferida."""
+        self.load()
+        with self._lock:
+            self._data[key] = value
+            meta = self._access.setdefault(key, [0, 0])
+            meta[0] = time.time()
+            self._access_changed[key] = list(meta)
+            self._mark_changed(key, value)
+            self._index_bitrate(key)
+            self._evict(protect=key)
+            self._schedule_flush()
+    
+    def discard_value(self, value: str) -> List[str]:
+        """
+        Elimina todas las entradas cuyo valor es value.
+        
+        Sirve para olvidar un file_id que Telegram ya no acepta, junto con sus
+        alias (otras calidades o track_id de la misma grabación, índice ISRC).
+        
+        Returns:
+            Las claves eliminadas
+        """
+        self.load()
+        with self._lock:
+            keys = [key for key, stored in self._data.items() if stored == value]
+            for key in keys:
+                del self._data[key]
+                self._access.pop(key, None)
+                self._access_changed.pop(key, None)
+                self._mark_removed(key)
+                self._unindex_bitrate(key)
+            if keys:
+                self._schedule_flush()
+        return keys
+    
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Incorpora los cambios que otros procesos hayan escrito en el almacenamiento.
+        
+        Siempre que el motor lo permite se leen sólo los cambios posteriores a
+        la última lectura; los que sólo tocan metadatos de acceso no cuentan
+        como cambios de datos. Los cambios propios aún pendientes de escribir
+        se mantienen por encima de lo leído. Salvo con force, se comprueba
+        como mucho una vez cada VAULT_REFRESH_INTERVAL segundos.
+        
+        Returns:
+            True si cambiaron las entradas
+        """
+        self.load()
+        now = time.monotonic()
+        if not force and now - self._last_refresh < VAULT_REFRESH_INTERVAL:
+            return False
+        self._last_refresh = now
+        
+        with self._lock:
+            if not self._storage.has_external_changes():
+                return False
+            changes = self._storage.load_changes()
+            if changes is None:
+                self._reload()
+                return True
+            
+            changed, removed, stored_access = changes
+            applied = 0
+            for key in removed:
+                if key in self._data and key not in self._changed:
+                    del self._data[key]
+                    self._access.pop(key, None)
+                    self._access_changed.pop(key, None)
+                    self._unindex_bitrate(key)
+                    applied += 1
+            for key, value in changed.items():
+                if key in self._changed or key in self._removed:
+                    continue
+                if self._data.get(key) != value:
+                    self._data[key] = value
+                    self._index_bitrate(key)
+                    applied += 1
+                self._access.setdefault(key, [0, 0])
+            for key, meta in stored_access.items():
+                if key in self._access and key not in self._access_changed:
+                    self._access[key] = list(meta)
+            if applied:
+                logging.info(f"Vault actualizado con {applied} cambios de otros procesos")
+            return applied > 0
+    
+    def _reload(self) -> None:
+        """Relee todo el almacenamiento conservando los cambios propios pendientes (requiere self._lock)."""
+        data = _apply_changes(self._storage.load(), self._changed, self._removed)
+        stored_access = self._storage.load_access()
+        access = {key: list(stored_access.get(key, self._access.get(key, [0, 0]))) for key in data}
+        for key, meta in self._access_changed.items():
+            if key in access:
+                access[key] = list(meta)
+        self._data, self._access = data, access
+        self._rebuild_bitrate_index()
+        logging.info(f"Vault recargado con cambios de otros procesos: {len(self._data)} entradas")
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Devuelve una copia de los datos actuales."""
+        self.load()
+        with self._lock:
+            return dict(self._data)
+    
+    def replace(self, data: Dict[str, Any]) -> bool:
+        """Sustituye todo el contenido del vault y lo escribe inmediatamente."""
+        self.load()
+        with self._lock:
+            for key in set(self._data) - set(data):
+                self._mark_removed(key)
+            for key, value in data.items():
+                if self._data.get(key) != value:
+                    self._mark_changed(key, value)
+                    self._access_changed[key] = list(self._access.setdefault(key, [time.time(), 0]))
+            self._data = data
+            self._evict()
+            self._rebuild_bitrate_index()
+        return self.flush()
+    
+    def flush(self) -> bool:
+        """Escribe en el motor de almacenamiento los cambios pendientes, si los hay."""
+        with self._lock:
+            if self._flush_timer:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._changed and not self._removed and not self._access_changed:
+                return True
+            changed, removed, access_changed = self._changed, self._removed, self._access_changed
+            self._changed, self._removed, self._access_changed = {}, set(), {}
+            data = dict(self._data)
+            access = {key: list(meta) for key, meta in self._access.items()}
+        
+        if not self._storage.write(changed, removed, data, access_changed, access):
+            # Reintentar en la próxima escritura programada
+            with self._lock:
+                for key, value in changed.items():
+                    self._changed.setdefault(key, value)
+                self._removed |= removed - set(self._changed)
+                for key, meta in access_changed.items():
+                    self._access_changed.setdefault(key, meta)
+            return False
+        return True
+    
+    def _migrate_collections(self) -> None:
+        """
+        Convierte las colecciones con file_ids duplicados al esquema normalizado (requiere self._lock).
+        
+        Cada file_id que también está guardado bajo una clave de pista se
+        sustituye por esa clave; los que no tienen pista asociada se conservan
+        tal cual para no perder la colección.
+        """
+        track_keys_by_file_id = {
+            value: key for key, value in self._data.items()
+            if isinstance(value, str) and is_track_key(key)
+        }
+        migrated = 0
+        for key, value in list(self._data.items()):
+            if not isinstance(value, list):
+                continue
+            refs = [track_keys_by_file_id.get(item, item) for item in value]
+            if refs != value:
+                self._data[key] = refs
+                self._mark_changed(key, refs)
+                migrated += 1
+        if migrated:
+            logging.info(f"Vault migrado al esquema normalizado: {migrated} colecciones")
+            self._schedule_flush()
+    
+    def _eviction_score(self, key: str) -> tuple:
+        """Puntuación de desalojo: se eliminan primero las entradas con menor valor."""
+        last_access, hits = self._access.get(key, (0, 0))
+        if self._eviction == "lfu":
+            return (hits, last_access)
+        if self._eviction == "size":
+            # Aciertos por byte ocupado: penaliza las entradas grandes poco usadas
+            size = len(json.dumps(self._data[key]))
+            return ((hits + 1) / size, last_access)
+        return (last_access, hits)
+    
+    def _evict(self, protect: Optional[str] = None) -> None:
+        """Desaloja entradas según la política configurada si se supera el límite (requiere self._lock)."""
+        if len(self._data) <= self._max_entries:
+            return
+        
+        # Liberar un pequeño margen para no recorrer el vault en cada inserción
+        target = max(0, self._max_entries - int(self._max_entries * VAULT_EVICTION_SLACK))
+        candidates = [key for key in self._data if key != protect]
+        victims = heapq.nsmallest(len(self._data) - target, candidates, key=self._eviction_score)
+        for key in victims:
+            del self._data[key]
+            self._access.pop(key, None)
+            self._access_changed.pop(key, None)
+            self._mark_removed(key)
+            self._unindex_bitrate(key)
+        logging.info(f"Vault limpiado ({self._eviction}): se eliminaron {len(victims)} entradas")
+    
+    def _rebuild_bitrate_index(self) -> None:
+        """Reconstruye el índice de bitrates por pista (requiere self._lock)."""
+        self._bitrates = {}
+        for key in self._data:
+            self._index_bitrate(key)
+    
+    def _index_bitrate(self, key: str) -> None:
+        match = QUALITY_KEY_REGEX.match(key)
+        if match:
+            self._bitrates.setdefault(match.group(1), set()).add(int(match.group(2)))
+    
+    def _unindex_bitrate(self, key: str) -> None:
+        match = QUALITY_KEY_REGEX.match(key)
+        if match:
+            cached = self._bitrates.get(match.group(1))
+            if cached:
+                cached.discard(int(match.group(2)))
+                if not cached:
+                    del self._bitrates[match.group(1)]
+    
+    def _mark_changed(self, key: str, value: Any) -> None:
+        self._changed[key] = value
+        self._removed.discard(key)
+    
+    def _mark_removed(self, key: str) -> None:
+        self._changed.pop(key, None)
+        self._removed.add(key)
+    
+    def _schedule_flush(self) -> None:
+        """Programa una escritura diferida si no hay una pendiente."""
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self._flush_interval, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+_vault = Vault()
+atexit.register(_vault.flush)
+
+def get_vault() -> Vault:
+    """Devuelve la instancia del vault compartida por todo el proceso."""
+    return _vault
+
+def load_vault() -> Dict[str, Any]:
+    """
+    Carga los datos del vault.
+    
+    Returns:
+        Copia del diccionario con los datos del vault.
+    """
+    return _vault.snapshot()
+
 def save_vault(data: Dict[str, Any]) -> bool:
     """
-    Guarda los datos del vault en el archivo JSON.
+    Guarda los datos del vault en el motor de almacenamiento configurado.
     
     Args:
         data: Diccionario con los datos a guardar
@@ -96,53 +1139,101 @@ def save_vault(data: Dict[str, Any]) -> bool:
         logging.error("Intentando guardar datos inválidos en el vault")
         return False
     
-    # Limitar el tamaño del vault
-    if len(data) > MAX_VAULT_ENTRIES:
-        # Ordenar por timestamp si existe, de lo contrario usar orden arbitrario
-        items_to_remove = len(data) - MAX_VAULT_ENTRIES
-        keys_to_remove = list(data.keys())[:items_to_remove]
-        for key in keys_to_remove:
-            del data[key]
-        logging.info(f"Vault limpiado: se eliminaron {items_to_remove} entradas antiguas")
-    
-    try:
-        # Crear backup primero
-        if os.path.exists(VAULT_JSON):
-            create_backup(data)
-        
-        # Guardar datos actualizados
-        with open(VAULT_JSON, 'w') as f:
-            json.dump(data, f, indent=4)
-        return True
-    except Exception as e:
-        logging.error(f"Error guardando vault: {str(e)}")
-        return False
+    return _vault.replace(data)
 
 def add_to_vault(key: str, value: Union[str, List[str]]) -> bool:
     """
     Añade una entrada al vault con verificación de tamaño.
     
+    La entrada queda disponible de inmediato en memoria; la escritura en
+    disco se realiza de forma diferida.
+    
     Args:
         key: Clave única para el elemento
-        value: File ID de Telegram o lista de File IDs
+        value: File ID de Telegram, o para colecciones la lista ordenada de
+            claves de pista (o File IDs cuando no hay pista asociada)
         
     Returns:
         True si se añadió correctamente, False en caso contrario
     """
-    data = load_vault()
-    data[key] = value
-    return save_vault(data)
+    if not validate_vault_data({key: value}):
+        logging.error("Intentando guardar datos inválidos en el vault")
+        return False
+    _vault.set(key, value)
+    return True
 
-def get_from_vault(key: str) -> Optional[Union[str, List[str]]]:
+def get_from_vault(key: str, quality_fallback: bool = True) -> Optional[Union[str, List[str]]]:
     """
     Obtiene una entrada del vault.
     
+    Para claves de pista ("{track_id}_{bitrate}") o de ISRC sin coincidencia
+    exacta se prueba otra calidad en caché según VAULT_QUALITY_FALLBACK.
+    
     Args:
         key: Clave a buscar
+        quality_fallback: Permitir servir la pista con otra calidad
         
     Returns:
         Valor asociado a la clave o None si no existe
     """
-    data = load_vault()
-    return data.get(key)
+    match = QUALITY_KEY_REGEX.match(key)
+    if match and quality_fallback:
+        return _vault.get_track(match.group(1), int(match.group(2)))
+    return _vault.get(key)
+
+def remove_file_id_from_vault(file_id: str) -> List[str]:
+    """
+    Elimina del vault un file_id que Telegram ya no acepta.
+    
+    Args:
+        file_id: File ID de Telegram
+        
+    Returns:
+        Las claves que apuntaban a ese file_id
+    """
+    return _vault.discard_value(file_id)
 
+def find_track_in_vault(key: str) -> Tuple[Optional[str], Optional[int]]:
+    """
+    Busca una clave con calidad ("{track_id}_{bitrate}" o de ISRC) como get_from_vault.
+    
+    Args:
+        key: Clave a buscar
+        
+    Returns:
+        Tupla (file_id, bitrate con el que está realmente guardado), que puede
+        ser otra calidad según VAULT_QUALITY_FALLBACK, o (None, None)
+    """
+    match = QUALITY_KEY_REGEX.match(key)
+    if not match:
+        return None, None
+    return _vault.find_track(match.group(1), int(match.group(2)))
+
+def resolve_collection(key: str) -> Optional[List[str]]:
+    """
+    Obtiene los file_ids de una colección guardada en el vault.
+    
+    Las colecciones guardan referencias a las claves de sus pistas, que se
+    resuelven a través de la caché de pistas individuales.
+    
+    Args:
+        key: Clave de la colección (p.ej. "album_<id>")
+        
+    Returns:
+        Lista ordenada de file_ids, o None si la colección no existe o
+        alguna de sus pistas ya no está en el vault
+    """
+    refs = get_from_vault(key)
+    if not isinstance(refs, list):
+        return None
+    
+    file_ids = []
+    for ref in refs:
+        if is_track_key(ref):
+            file_id = get_from_vault(ref)
+            if not isinstance(file_id, str):
+                return None
+            file_ids.append(file_id)
+        else:
+            file_ids.append(ref)
+    return file_ids
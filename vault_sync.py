@@ -0,0 +1,332 @@
+import re
+import os
+import json
+import asyncio
+import logging
+import argparse
+from typing import Dict, Any, Optional, List, Callable
+
+from vault import add_to_vault, get_from_vault, get_vault
+
+VAULT_SYNC_CHECKPOINT = "vault_sync.checkpoint.json"
+VAULT_SYNC_BATCH_SIZE = int(os.environ.get("VAULT_SYNC_BATCH_SIZE", 50))  # Mensajes por lote
+VAULT_SYNC_BATCH_PAUSE = float(os.environ.get("VAULT_SYNC_BATCH_PAUSE", 2))  # Segundos entre lotes
+VAULT_SYNC_MAX_GAP = 200  # Mensajes vacíos seguidos tras los que se da por terminado el canal
+
+# Formatos de caption que escribe send_and_save_audio
+CAPTION_TRACK_REGEX = re.compile(r'Track: (\d+)')
+CAPTION_COLLECTION_REGEX = re.compile(r'^(\w+) (?:pista|track) (\d+)/(\d+)(?:: (.+))?', re.IGNORECASE)
+
+def parse_caption(caption: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Extrae la información de un caption del canal del vault.
+    
+    Reconoce "Track: <id>" (también al final de los captions de colecciones)
+    y "<Album|Playlist> pista i/n: Artista - Título".
+    
+    Args:
+        caption: Caption del mensaje
+    
+    Returns:
+        Diccionario con track_id y/o position, total y title, o None si no
+        es un caption del vault
+    """
+    if not caption:
+        return None
+    
+    info = {}
+    match = CAPTION_COLLECTION_REGEX.match(caption)
+    if match:
+        info["collection_type"] = match.group(1).lower()
+        info["position"] = int(match.group(2))
+        info["total"] = int(match.group(3))
+        if match.group(4):
+            info["title"] = match.group(4).split("\n", 1)[0].strip()
+    
+    match = CAPTION_TRACK_REGEX.search(caption)
+    if match:
+        info["track_id"] = match.group(1)
+    
+    return info or None
+
+def infer_bitrate(mime_type: Optional[str], file_size: Optional[int], duration: Optional[int]) -> Optional[int]:
+    """
+    Deduce el bitrate de Deezer (formato de TrackFormats) de un audio del canal.
+    
+    Returns:
+        9 (FLAC), 3 (MP3 320) o 1 (MP3 128), o None si no se puede deducir
+    """
+    if mime_type == "audio/flac":
+        return 9
+    if mime_type in ("audio/mpeg", "audio/mp3") and file_size and duration:
+        kbps = file_size * 8 / duration / 1000
+        return 3 if kbps >= 200 else 1
+    return None
+
+class MessageFeed:
+    """
+    Fuente de mensajes del canal del vault.
+    
+    Cada mensaje es un diccionario con message_id, caption, file_id,
+    mime_type, file_size y duration (los cuatro últimos del audio, o None si
+    el mensaje no es un audio).
+    """
+    
+    async def fetch(self, start_id: int, limit: int) -> List[Dict[str, Any]]:
+        """Devuelve los mensajes con message_id en [start_id, start_id + limit)."""
+        raise NotImplementedError
+    
+    async def latest_message_id(self) -> Optional[int]:
+        """Devuelve el último message_id del canal, o None si no se conoce."""
+        return None
+
+class RecordedFeed(MessageFeed):
+    """Fuente local: un archivo JSONL con un mensaje grabado por línea."""
+    
+    def __init__(self, path: str):
+        self._messages = {}
+        with open(path, 'r', encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    message = json.loads(line)
+                    self._messages[int(message["message_id"])] = message
+    
+    async def fetch(self, start_id: int, limit: int) -> List[Dict[str, Any]]:
+        return [
+            self._messages[message_id]
+            for message_id in range(start_id, start_id + limit)
+            if message_id in self._messages
+        ]
+    
+    async def latest_message_id(self) -> Optional[int]:
+        return max(self._messages, default=0)
+
+class ForwardingFeed(MessageFeed):
+    """
+    Fuente real: lee el canal del vault reenviando cada mensaje.
+    
+    La Bot API no permite leer el historial de un chat, así que cada mensaje
+    se reenvía a un chat auxiliar (scratch_chat_id), se leen su caption y su
+    audio, y se borra el reenvío. Opcionalmente graba los mensajes leídos en
+    un JSONL reutilizable con RecordedFeed.
+    """
+    
+    def __init__(self, bot, source_chat_id, scratch_chat_id, record_path: Optional[str] = None):
+        self._bot = bot
+        self._source_chat_id = source_chat_id
+        self._scratch_chat_id = scratch_chat_id
+        self._record_path = record_path
+    
+    async def fetch(self, start_id: int, limit: int) -> List[Dict[str, Any]]:
+        from telegram.error import BadRequest, RetryAfter
+        
+        messages = []
+        for message_id in range(start_id, start_id + limit):
+            try:
+                forwarded = await self._bot.forward_message(
+                    chat_id=self._scratch_chat_id,
+                    from_chat_id=self._source_chat_id,
+                    message_id=message_id,
+                    disable_notification=True
+                )
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                return messages + await self.fetch(message_id, start_id + limit - message_id)
+            except BadRequest:
+                # Mensaje borrado o inexistente
+                continue
+            
+            try:
+                await self._bot.delete_message(chat_id=self._scratch_chat_id, message_id=forwarded.message_id)
+            except Exception as e:
+                logging.warning(f"No se pudo borrar el reenvío {forwarded.message_id}: {str(e)}")
+            
+            audio = forwarded.audio
+            message = {
+                "message_id": message_id,
+                "caption": forwarded.caption,
+                "file_id": audio.file_id if audio else None,
+                "mime_type": audio.mime_type if audio else None,
+                "file_size": audio.file_size if audio else None,
+                "duration": audio.duration if audio else None,
+            }
+            messages.append(message)
+        
+        if self._record_path and messages:
+            with open(self._record_path, 'a', encoding="utf-8") as f:
+                for message in messages:
+                    f.write(json.dumps(message) + "\n")
+        return messages
+    
+    async def latest_message_id(self) -> Optional[int]:
+        # No se escribe en el canal que se está reconstruyendo para conocer su último
+        # message_id: el importador termina tras VAULT_SYNC_MAX_GAP mensajes vacíos seguidos
+        return None
+
+class DeezerTitleResolver:
+    """
+    Resuelve el track_id de captions antiguos que sólo tienen "Artista - Título".
+    
+    Busca en Deezer y acepta el primer resultado cuya duración coincida con
+    la del audio (±2 segundos).
+    """
+    
+    def __init__(self, dz):
+        self._dz = dz
+    
+    def __call__(self, title: str, duration: Optional[int]) -> Optional[str]:
+        try:
+            results = self._dz.api.search_track(title, limit=5).get('data', [])
+        except Exception as e:
+            logging.warning(f"No se pudo buscar '{title}' en Deezer: {str(e)}")
+            return None
+        for track in results:
+            if duration is None or abs(track.get('duration', 0) - duration) <= 2:
+                return str(track.get('id'))
+        return None
+
+class VaultImporter:
+    """
+    Reconstruye las entradas de pistas del vault a partir del canal del vault.
+    
+    Procesa los mensajes por lotes y guarda tras cada lote un checkpoint con
+    el último message_id procesado, de modo que una ejecución interrumpida
+    continúa donde se quedó. Al llegar al final se marca el checkpoint como
+    terminado.
+    """
+    
+    def __init__(self, feed: MessageFeed, checkpoint_path: str = VAULT_SYNC_CHECKPOINT,
+                 batch_size: int = VAULT_SYNC_BATCH_SIZE, batch_pause: float = VAULT_SYNC_BATCH_PAUSE,
+                 resolver: Optional[Callable[[str, Optional[int]], Optional[str]]] = None):
+        self._feed = feed
+        self._checkpoint_path = checkpoint_path
+        self._batch_size = batch_size
+        self._batch_pause = batch_pause
+        self._resolver = resolver
+    
+    def load_checkpoint(self) -> Dict[str, Any]:
+        """Lee el checkpoint de la última ejecución."""
+        if os.path.exists(self._checkpoint_path):
+            try:
+                with open(self._checkpoint_path, 'r') as f:
+                    return json.load(f)
+            except Exception as e:
+                logging.warning(f"Checkpoint de sincronización inválido, empezando desde el principio: {str(e)}")
+        return {"last_message_id": 0, "imported": 0}
+    
+    def save_checkpoint(self, checkpoint: Dict[str, Any]) -> None:
+        """Guarda el checkpoint de forma atómica."""
+        tmp_path = f"{self._checkpoint_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self._checkpoint_path)
+    
+    def pending(self) -> bool:
+        """Indica si hay una sincronización empezada que no llegó al final del canal."""
+        return os.path.exists(self._checkpoint_path) and not self.load_checkpoint().get("done", False)
+    
+    def import_message(self, message: Dict[str, Any]) -> Optional[str]:
+        """
+        Añade al vault la pista de un mensaje del canal.
+        
+        Returns:
+            Clave añadida, o None si el mensaje no aporta una entrada nueva
+        """
+        if not message.get("file_id"):
+            return None
+        info = parse_caption(message.get("caption"))
+        if not info:
+            return None
+        
+        track_id = info.get("track_id")
+        if not track_id and self._resolver and info.get("title"):
+            track_id = self._resolver(info["title"], message.get("duration"))
+        bitrate = infer_bitrate(message.get("mime_type"), message.get("file_size"), message.get("duration"))
+        if not track_id or not bitrate:
+            return None
+        
+        key = f"{track_id}_{bitrate}"
+        if get_from_vault(key, quality_fallback=False):
+            return None
+        add_to_vault(key, message["file_id"])
+        return key
+    
+    async def run(self, until_id: Optional[int] = None) -> int:
+        """
+        Importa mensajes desde el checkpoint hasta until_id (o el final del canal).
+        
+        Returns:
+            Número de entradas añadidas en esta ejecución
+        """
+        checkpoint = self.load_checkpoint()
+        if until_id is None:
+            until_id = await self._feed.latest_message_id()
+        
+        previously_imported = checkpoint["imported"]
+        imported = 0
+        empty_run = 0
+        next_id = checkpoint["last_message_id"] + 1
+        logging.info(f"Sincronizando vault desde el mensaje {next_id} hasta {until_id or 'el final'}")
+        
+        while until_id is None or next_id <= until_id:
+            limit = self._batch_size if until_id is None else min(self._batch_size, until_id - next_id + 1)
+            messages = await self._feed.fetch(next_id, limit)
+            
+            for message in messages:
+                if self.import_message(message):
+                    imported += 1
+            
+            # Sin límite conocido, un hueco largo sin mensajes marca el final del canal
+            empty_run = 0 if messages else empty_run + limit
+            next_id += limit
+            checkpoint = {"last_message_id": next_id - 1, "imported": previously_imported + imported}
+            await asyncio.to_thread(get_vault().flush)
+            self.save_checkpoint(checkpoint)
+            logging.info(f"Sincronización del vault: mensaje {next_id - 1}, {imported} entradas añadidas")
+            
+            if until_id is None and empty_run >= VAULT_SYNC_MAX_GAP:
+                # El hueco final no cuenta como procesado: ahí llegarán los mensajes nuevos
+                checkpoint["last_message_id"] -= empty_run
+                break
+            if self._batch_pause:
+                await asyncio.sleep(self._batch_pause)
+        
+        checkpoint["done"] = True
+        self.save_checkpoint(checkpoint)
+        return imported
+
+async def _main() -> None:
+    parser = argparse.ArgumentParser(description="Reconstruye el vault a partir del canal del vault.")
+    parser.add_argument("--recorded", help="JSONL de mensajes grabados (en lugar de leer Telegram)")
+    parser.add_argument("--record", help="Grabar los mensajes leídos de Telegram en este JSONL")
+    parser.add_argument("--until", type=int, help="Último message_id a procesar")
+    parser.add_argument("--resolve-titles", action="store_true",
+                        help="Buscar en Deezer los captions antiguos sin track_id (requiere DEEZER_AR)")
+    args = parser.parse_args()
+    
+    from dotenv import load_dotenv
+    load_dotenv()
+    
+    resolver = None
+    if args.resolve_titles:
+        from deezer import Deezer
+        dz = Deezer()
+        if not dz.login_via_arl(os.environ["DEEZER_AR"]):
+            raise Exception("Fallo en la autenticación: verifica tu ARL.")
+        resolver = DeezerTitleResolver(dz)
+    
+    if args.recorded:
+        feed = RecordedFeed(args.recorded)
+        await VaultImporter(feed, batch_pause=0, resolver=resolver).run(args.until)
+        return
+    
+    from telegram import Bot
+    
+    bot = Bot(os.environ["TELEGRAM_TOKEN"])
+    async with bot:
+        feed = ForwardingFeed(bot, os.environ["VAULT_CHATID"], os.environ["VAULT_SYNC_SCRATCH_CHATID"], args.record)
+        await VaultImporter(feed, resolver=resolver).run(args.until)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    asyncio.run(_main())